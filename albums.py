@@ -0,0 +1,43 @@
+import asyncio
+
+# ========= АЛЬБОМИ =========
+# Telegram шле кожне фото альбому окремим апдейтом з однаковим media_group_id.
+# Збираємо їх у памʼяті, поки приходять нові (debounce), і віддаємо одним звітом.
+class AlbumCollector:
+    def __init__(self, on_complete, window: float = 1.5):
+        self.on_complete = on_complete   # async fn(album: dict)
+        self.window = window
+        self._albums: dict[str, dict] = {}
+
+    def add(self, mgid: str, user_id: int, chat_id: int, caption: str, file_id: str, mtype: str, unique_id: str = None):
+        album = self._albums.get(mgid)
+        if album is None:
+            album = self._albums[mgid] = {
+                "media_group_id": mgid, "user_id": user_id, "chat_id": chat_id,
+                "caption": "", "items": [], "timer": None,
+            }
+        if caption and not album["caption"]:
+            album["caption"] = caption
+        album["items"].append((mtype, file_id, unique_id))
+        if album["timer"] is not None:
+            album["timer"].cancel()
+        album["timer"] = asyncio.get_running_loop().call_later(self.window, self._fire, mgid)
+
+    def _fire(self, mgid: str):
+        asyncio.create_task(self._complete(mgid))
+
+    async def _complete(self, mgid: str):
+        album = self._albums.pop(mgid, None)
+        if album is None:
+            return
+        try:
+            await self.on_complete(album)
+        except Exception as e:
+            print("ALBUM ERROR:", mgid, e)
+
+    async def stop(self):
+        # недозібрані альбоми зберігаємо як є
+        for mgid, album in list(self._albums.items()):
+            if album["timer"] is not None:
+                album["timer"].cancel()
+            await self._complete(mgid)
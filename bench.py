@@ -0,0 +1,346 @@
+"""Навантажувальний тест: синтетичні апдейти -> /webhook (in-process ASGI) -> фейковий Bot API.
+
+    python bench.py --users 2000 --concurrency 200 --api-latency 0.05
+
+Бот працює повністю (міграції, outbox, кеші, лімітер), лише Bot API підмінено
+локальним HTTP-сервером із затримкою. Наприкінці — апдейти/с, p50/p95/p99
+латентності вебхука за типами та конкуренція за SQLite.
+"""
+import argparse, asyncio, json, os, random, socket, sys, tempfile, threading, time
+from collections import defaultdict
+from urllib.parse import parse_qsl
+import metrics   # не читає env — безпечно імпортувати до налаштування бота
+
+ADMIN_CHAT = -1001
+MODERATOR = 1
+CHANNEL = -1002
+
+# ========= ФЕЙКОВИЙ BOT API =========
+class FakeBotAPI:
+    # окремий потік зі своїм event loop — не краде час у бота, що вимірюється
+    def __init__(self, latency: float, jitter: float):
+        self.latency, self.jitter = latency, jitter
+        self.calls: dict[str, int] = defaultdict(int)
+        self.buttons: dict[int, tuple] = {}   # chat_id -> (seq, [callback_data]) з останньої клавіатури
+        self.mod_queue: list[str] = []        # кнопки mod|ok|N, надіслані в адмін-чат
+        self._seq = 0
+        self._msg_id = 0
+        self._lock = threading.Lock()
+        self.port = _free_port()
+        self.server = None
+
+    def _message(self, chat_id, p: dict) -> dict:
+        self._msg_id += 1
+        chat = {"id": chat_id, "type": "private"} if chat_id > 0 else {"id": chat_id, "type": "channel", "title": "c"}
+        return {"message_id": self._msg_id, "date": int(time.time()), "chat": chat, "text": p.get("text", "")}
+
+    def _remember(self, chat_id, p: dict):
+        markup = p.get("reply_markup")
+        if not markup:
+            return
+        data = [b["callback_data"] for row in json.loads(markup).get("inline_keyboard", []) for b in row
+                if "callback_data" in b]
+        with self._lock:
+            self._seq += 1
+            if chat_id == ADMIN_CHAT:
+                self.mod_queue += [d for d in data if d.startswith("mod|ok|")]
+            else:
+                self.buttons[chat_id] = (self._seq, data)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while (await receive())["type"] != "lifespan.shutdown":
+                await send({"type": "lifespan.startup.complete"})
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        body = b""
+        while True:
+            ev = await receive()
+            body += ev.get("body", b"")
+            if not ev.get("more_body"):
+                break
+        method = scope["path"].rsplit("/", 1)[-1]
+        p = dict(parse_qsl(body.decode()))
+        self.calls[method] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        chat_id = p.get("chat_id", "0")
+        chat_id = int(chat_id) if chat_id.lstrip("-").isdigit() else CHANNEL
+        self._remember(chat_id, p)
+        if method == "getMe":
+            result = {"id": 42, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "sendMediaGroup":
+            result = [self._message(chat_id, {}) for _ in json.loads(p.get("media", "[]"))]
+        elif method.startswith("send") or method == "copyMessage":
+            result = self._message(chat_id, p)
+        else:
+            result = True
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": payload})
+
+    def start(self):
+        import uvicorn
+        self.server = uvicorn.Server(uvicorn.Config(self, host="127.0.0.1", port=self.port,
+                                                    log_level="warning", lifespan="off"))
+        threading.Thread(target=self.server.run, daemon=True).start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def stop(self):
+        self.server.should_exit = True
+
+    def last_buttons(self, chat_id):
+        return self.buttons.get(chat_id, (0, []))
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# ========= ГЕНЕРАТОР АПДЕЙТІВ =========
+class Traffic:
+    def __init__(self, bot, api: FakeBotAPI, client, dup_rate: float):
+        self.bot, self.api, self.client = bot, api, client
+        self.dup_rate = dup_rate
+        self.update_id = 0
+        self.msg_id = 0
+        self.lat: dict[str, list] = defaultdict(list)
+        self.status: dict[int, int] = defaultdict(int)
+        self.media_uids: list[str] = []
+
+    async def post(self, kind: str, body: dict):
+        self.update_id += 1
+        body["update_id"] = self.update_id
+        t0 = time.perf_counter()
+        r = await self.client.post(f"/webhook/{self.bot.WEBHOOK_SECRET}", json=body)
+        self.lat[kind].append(time.perf_counter() - t0)
+        self.status[r.status_code] += 1
+
+    def _msg(self, uid: int, chat_id: int | None = None, **extra) -> dict:
+        self.msg_id += 1
+        chat_id = uid if chat_id is None else chat_id
+        chat = {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"}
+        return {"message_id": self.msg_id, "date": int(time.time()), "chat": chat,
+                "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}", "username": f"u{uid}"}, **extra}
+
+    def _media(self, uid: int) -> dict:
+        if self.media_uids and random.random() < self.dup_rate:
+            unique = random.choice(self.media_uids)          # пересланий чужий кадр
+        else:
+            unique = f"U{uid}x{self.msg_id}"
+            self.media_uids.append(unique)
+        if random.random() < 0.8:
+            return {"photo": [{"file_id": f"F{unique}", "file_unique_id": unique, "width": 1280, "height": 720}]}
+        return {"video": {"file_id": f"F{unique}", "file_unique_id": unique, "width": 1280, "height": 720,
+                          "duration": 10}}
+
+    async def text(self, uid: int, text: str, chat_id: int | None = None):
+        extra = {"text": text}
+        if text.startswith("/"):
+            extra["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self.post("command" if text.startswith("/") else "text", {"message": self._msg(uid, chat_id, **extra)})
+
+    async def callback(self, uid: int, data: str, chat_id: int | None = None):
+        msg = self._msg(42, chat_id or uid, text="…")
+        await self.post(data.split("|", 1)[0], {"callback_query": {
+            "id": str(self.update_id), "from": {"id": uid, "is_bot": False, "first_name": f"u{uid}"},
+            "chat_instance": "b", "data": data, "message": msg}})
+
+    async def wait_button(self, uid: int, prefix: str, after: int, timeout: float = 10.0) -> str | None:
+        # користувач тисне лише кнопки, які бот справді надіслав
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            seq, data = self.api.last_buttons(uid)
+            if seq > after:
+                for d in data:
+                    if d.startswith(prefix):
+                        return d
+            await asyncio.sleep(0.02)
+        return None
+
+    async def report(self, uid: int, album: bool):
+        after = self.api.last_buttons(uid)[0]
+        if album:
+            mgid = f"G{uid}x{self.msg_id}"
+            await asyncio.gather(*(self.post("album", {"message": self._msg(
+                uid, media_group_id=mgid, caption="альбом" if i == 0 else None, **self._media(uid))})
+                for i in range(random.randint(2, 4))))
+        else:
+            await self.post("media", {"message": self._msg(uid, caption="порушення", **self._media(uid))})
+        cat = await self.wait_button(uid, "cat|", after)
+        if not cat:
+            return   # дублікат або відкинуто лімітером
+        after = self.api.last_buttons(uid)[0]
+        await self.callback(uid, random.choice([b for b in self.api.last_buttons(uid)[1] if b.startswith("cat|")]))
+        det = await self.wait_button(uid, "det|done|", after)
+        if not det:
+            return
+        rec_id = det.rsplit("|", 1)[1]
+        if random.random() < 0.6:
+            await self.callback(uid, f"det|loc|{rec_id}")
+            if random.random() < 0.5:
+                await self.post("location", {"message": self._msg(
+                    uid, location={"latitude": 47.8 + random.random() / 10, "longitude": 35.1 + random.random() / 10})})
+            else:
+                await self.text(uid, f"вул. Соборна, {random.randint(1, 200)}")
+        if random.random() < 0.4:
+            await self.callback(uid, f"det|note|{rec_id}")
+            await self.text(uid, f"AP{random.randint(1000, 9999)}XX, смуга {random.randint(1, 3)}")
+        await self.callback(uid, det)
+
+    async def user(self, uid: int, reports: int):
+        if random.random() < 0.3:
+            await self.text(uid, "/start")
+        else:
+            await self.text(uid, "привіт")
+        for _ in range(reports):
+            await self.report(uid, album=random.random() < 0.2)
+
+    async def moderator(self, stop: asyncio.Event, reject_rate: float):
+        while not stop.is_set() or self.api.mod_queue:
+            if not self.api.mod_queue:
+                await asyncio.sleep(0.05)
+                continue
+            data = self.api.mod_queue.pop(0)
+            if random.random() < reject_rate:
+                data = data.replace("mod|ok|", "mod|no|")
+            await self.callback(MODERATOR, data, chat_id=ADMIN_CHAT)
+
+# ========= ЗВІТ =========
+def pct(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(round(p / 100 * (len(s) - 1))))] * 1000
+
+def hist_summary(h, label: str = "") -> tuple[int, float, float]:
+    # (кількість, середнє мс, частка > 10 мс) з гістограми metrics.py
+    s = h._series.get(label)
+    n = s[len(metrics.BUCKETS)] if s else 0
+    if not n:
+        return 0, 0.0, 0.0
+    return n, s[-1] / n * 1000, (n - s[metrics.BUCKETS.index(0.01)]) / n
+
+def report(traffic: Traffic, elapsed: float, api: FakeBotAPI, extra: dict) -> dict:
+    all_lat = [x for v in traffic.lat.values() for x in v]
+    out = {
+        "updates": len(all_lat),
+        "seconds": round(elapsed, 2),
+        "updates_per_s": round(len(all_lat) / elapsed, 1) if elapsed else 0.0,
+        "status": dict(traffic.status),
+        "latency_ms": {k: {"n": len(v), "p50": round(pct(v, 50), 2), "p95": round(pct(v, 95), 2),
+                           "p99": round(pct(v, 99), 2)}
+                       for k, v in sorted(traffic.lat.items()) + [("ALL", all_lat)]},
+        "bot_api_calls": dict(sorted(api.calls.items())),
+        **extra,
+    }
+    n, avg, slow = hist_summary(metrics.DB_LOCK_WAIT)
+    tn, tavg, tslow = hist_summary(metrics.DB_SECONDS, "tx")
+    out["db"] = {
+        "write_tx": tn, "tx_avg_ms": round(tavg, 2), "tx_over_10ms": round(tslow, 4),
+        "lock_waits": n, "lock_wait_avg_ms": round(avg, 2), "lock_wait_over_10ms": round(slow, 4),
+        "errors": sum(metrics.DB_ERRORS._values.values()),
+    }
+    out["handler_errors"] = dict(metrics.HANDLER_ERRORS._values)
+    return out
+
+def print_report(r: dict):
+    print(f"\n{r['updates']} апдейтів за {r['seconds']} с — {r['updates_per_s']} апд/с; HTTP {r['status']}")
+    print(f"{'тип':<12}{'n':>8}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}")
+    for k, v in r["latency_ms"].items():
+        print(f"{k:<12}{v['n']:>8}{v['p50']:>10}{v['p95']:>10}{v['p99']:>10}")
+    d = r["db"]
+    print(f"SQLite: {d['write_tx']} транзакцій, сер. {d['tx_avg_ms']} мс ({d['tx_over_10ms']:.1%} > 10 мс); "
+          f"очікування локу сер. {d['lock_wait_avg_ms']} мс ({d['lock_wait_over_10ms']:.1%} > 10 мс); "
+          f"помилок {d['errors']}")
+    print("Bot API:", ", ".join(f"{k}={v}" for k, v in r["bot_api_calls"].items()))
+    if r["handler_errors"]:
+        print("Помилки хендлерів:", r["handler_errors"])
+    for k in ("ingest", "outbox_pending", "drain_s"):
+        if k in r:
+            print(f"{k}: {r[k]}")
+
+# ========= ЗАПУСК =========
+async def run(args) -> dict:
+    api = FakeBotAPI(args.api_latency, args.api_jitter)
+    api.start()
+    os.environ["BOT_API_URL"] = f"http://127.0.0.1:{api.port}"
+    import httpx
+    import bot
+
+    await bot.on_startup()
+    transport = httpx.ASGITransport(app=bot.app)
+    stop = asyncio.Event()
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            traffic = Traffic(bot, api, client, args.dup_rate)
+            mod = asyncio.create_task(traffic.moderator(stop, args.reject_rate))
+            sem = asyncio.Semaphore(args.concurrency)
+
+            async def one(uid):
+                async with sem:
+                    await traffic.user(uid, args.reports)
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(100000 + i) for i in range(args.users)))
+            stop.set()
+            await mod
+            if bot.ingest:
+                # у режимі queue вебхук лише ставить у чергу — пропускна здатність рахується до її спорожнення
+                while bot.ingest.processed + bot.ingest.failed < bot.ingest.accepted:
+                    await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - t0
+
+            extra = {}
+            if bot.ingest:
+                extra["ingest"] = bot.ingest.stats()
+            # outbox доганяє у фоні — окремо, щоб не змішувати з латентністю вебхука
+            t1 = time.perf_counter()
+            while await bot.outbox.pending() and time.perf_counter() - t1 < args.drain:
+                await asyncio.sleep(0.1)
+            extra["outbox_pending"] = await bot.outbox.pending()
+            extra["drain_s"] = round(time.perf_counter() - t1, 2)
+            return report(traffic, elapsed, api, extra)
+    finally:
+        await bot.on_shutdown()
+        api.stop()
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--users", type=int, default=500, help="кількість симульованих користувачів")
+    ap.add_argument("--reports", type=int, default=1, help="репортів на користувача")
+    ap.add_argument("--concurrency", type=int, default=100, help="одночасно активних користувачів")
+    ap.add_argument("--api-latency", type=float, default=0.03, help="середня затримка Bot API, с")
+    ap.add_argument("--api-jitter", type=float, default=0.01, help="розкид затримки, с")
+    ap.add_argument("--dup-rate", type=float, default=0.05, help="частка повторно надісланих медіа")
+    ap.add_argument("--reject-rate", type=float, default=0.2, help="частка відхилених модератором")
+    ap.add_argument("--drain", type=float, default=30.0, help="скільки чекати спорожнення outbox, с")
+    ap.add_argument("--ingest", choices=("inline", "queue"), default=os.environ.get("INGEST_MODE", "inline"))
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="записати результат у файл")
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    # бот читає env при імпорті; ліміти й квоти — як у проді, якщо не перевизначені
+    os.environ.setdefault("BOT_TOKEN", "42:bench")
+    os.environ.setdefault("DB_PATH", os.path.join(workdir, "bench.db"))
+    os.environ.setdefault("ADMIN_CHAT_ID", str(ADMIN_CHAT))
+    os.environ.setdefault("CHANNEL_ID", str(CHANNEL))
+    os.environ.setdefault("TRUST_QUOTA", "1")
+    os.environ.setdefault("ALBUM_WINDOW", "0.3")
+    os.environ.setdefault("OUTBOX_GLOBAL_RATE", "1000")
+    os.environ.setdefault("OUTBOX_CHAT_RATE", "100000")
+    os.environ["INGEST_MODE"] = args.ingest
+    print(f"DB: {os.environ['DB_PATH']}", file=sys.stderr)
+
+    r = asyncio.run(run(args))
+    print_report(r)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(r, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
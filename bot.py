@@ -1,17 +1,60 @@
-import os, time, aiosqlite
-from fastapi import FastAPI, Request, HTTPException
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import os, re, time, math, json, asyncio, csv, io, calendar, hmac
+from contextlib import nullcontext
+_T_IMPORT = time.perf_counter()
+from fastapi import FastAPI, Request, HTTPException, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from telegram import Update, User, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    ConversationHandler, ContextTypes, filters
+    ContextTypes, TypeHandler, ApplicationHandlerStop, filters
 )
+from storage import Storage
+from ingest import IngestQueue
+from usercache import UserCache
+from outbox import Outbox, Lease
+from state import MemoryStateStore, SQLiteStateStore, user_scope, chat_scope
+from albums import AlbumCollector
+from dedup import UpdateDedup
+from drafts import DraftStore
+from retention import Retention, parse_days
+from ratelimit import SlidingWindowLimiter, parse_limits, OK, WARN
+from prefilter import Prefilter, allowed_updates, loads as json_loads
+import metrics, webhookreply
 
 # ========= ENV =========
 BOT_TOKEN     = os.environ["BOT_TOKEN"]
 CHANNEL_ID    = os.environ.get("CHANNEL_ID", "@zp_bez_pdr")   # @public або -100... для приватного
 WEBHOOK_SECRET= os.environ.get("WEBHOOK_SECRET", "zapbezpdr2025")
+WEBHOOK_URL   = os.environ.get("WEBHOOK_URL") or os.environ.get("RENDER_EXTERNAL_URL")  # якщо задано — бот сам викликає setWebhook
+BOT_API_URL   = os.environ.get("BOT_API_URL", "https://api.telegram.org")  # або локальний telegram-bot-api / фейк з bench.py
+BOT_API_POOL  = int(os.environ.get("BOT_API_POOL", "32"))    # HTTP-зʼєднань до Bot API (у PTB за замовчуванням 1)
+API_TOKEN     = os.environ.get("API_TOKEN", "")               # X-Api-Token для /stats, /metrics, /export, /ingest; порожній — вимкнені
 ADMIN_CHAT_ID = os.environ.get("ADMIN_CHAT_ID")               # -100... або id групи з модераторами
 TRUST_QUOTA   = int(os.environ.get("TRUST_QUOTA", "0"))       # скільки перших постів модеруємо
+DB_PATH       = os.environ.get("DB_PATH", "bot.db")
+INGEST_MODE   = os.environ.get("INGEST_MODE", "inline")       # inline | queue
+INGEST_WORKERS= int(os.environ.get("INGEST_WORKERS", "4"))
+INGEST_QUEUE  = int(os.environ.get("INGEST_QUEUE", "1000"))   # макс. апдейтів у черзі
+WEBHOOK_REPLY = os.environ.get("WEBHOOK_REPLY", "0") == "1"   # перший answerCallbackQuery/edit — у відповіді вебхука (лише inline)
+USER_CACHE    = int(os.environ.get("USER_CACHE", "10000"))    # скільки профілів тримаємо в памʼяті
+USER_FLUSH_S  = float(os.environ.get("USER_FLUSH_S", "5"))    # період запису змін users у БД
+OUTBOX_CHAT_RATE   = float(os.environ.get("OUTBOX_CHAT_RATE", "20"))    # постів/хв в один чат
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", "30"))  # повідомлень/с на весь бот
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "sqlite")     # sqlite | memory (лише для 1 процесу)
+ALBUM_WINDOW  = float(os.environ.get("ALBUM_WINDOW", "1.5"))  # с тиші, після яких альбом вважаємо зібраним
+RATE_LIMITS   = parse_limits(os.environ.get("RATE_LIMITS", "media=10/60,text=20/60,callback=60/60"))
+RATE_HOURLY   = int(os.environ.get("RATE_HOURLY", "30"))      # репортів (медіа) на годину, 0 = без ліміту
+MOD_NOTIFY    = os.environ.get("MOD_NOTIFY", "each")          # each — пост на кожен репорт | digest — лише /queue
+MOD_DIGEST_S  = int(os.environ.get("MOD_DIGEST_S", "600"))    # не частіше одного нагадування за стільки секунд
+DEDUP_CACHE   = int(os.environ.get("DEDUP_CACHE", "10000"))  # скільки останніх update_id памʼятаємо в процесі
+ARCHIVE_PATH  = os.environ.get("ARCHIVE_PATH") or os.path.splitext(DB_PATH)[0] + "-archive.db"
+RETENTION_ARCHIVE  = parse_days(os.environ.get("RETENTION_ARCHIVE", "rejected=30,published=180,legacy=365"))  # днів після рішення
+RETENTION_PURGE    = parse_days(os.environ.get("RETENTION_PURGE", "draft=2"))     # покинуті чернетки — видаляємо
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", "21600"))        # с між проходами, 0 — вимкнено
+DRAFT_TTL     = float(os.environ.get("DRAFT_TTL", "0"))      # с у памʼяті для незавершеної чернетки (лише 1 процес); 0 — писати кожну правку
+QUEUE_PAGE    = 10
+FAST_START    = os.environ.get("FAST_START", "1") == "1"      # getMe з кешу, другорядне — після першого апдейту
+STARTUP_DEFER_S = float(os.environ.get("STARTUP_DEFER_S", "10"))  # найпізніше, коли запускати відкладене
 
 # ========= КАТЕГОРІЇ =========
 CATEGORY_MAP = {
@@ -43,50 +86,264 @@ RULES_TEXT = (
 
 # ========= FASTAPI + PTB =========
 app = FastAPI()
-tg_app: Application = Application.builder().token(BOT_TOKEN).build()
+tg_app: Application = (
+    Application.builder().token(BOT_TOKEN)
+    .base_url(f"{BOT_API_URL}/bot").base_file_url(f"{BOT_API_URL}/file/bot")
+    .request(webhookreply.ReplyingRequest(connection_pool_size=BOT_API_POOL))
+    .get_updates_request(metrics.InstrumentedRequest())
+    .build()
+)
+db = Storage(DB_PATH)
+db.observe, db.observe_lock = metrics.db_observer, metrics.db_lock_observer
+users = UserCache(db, USER_CACHE, USER_FLUSH_S)
+outbox = Outbox(db, tg_app.bot, OUTBOX_CHAT_RATE, OUTBOX_GLOBAL_RATE, lease=Lease(db, "outbox"),
+                on_sent=lambda conn, ref: mark_published(conn, ref))
+state = SQLiteStateStore(db) if STATE_BACKEND == "sqlite" else MemoryStateStore()
+limiter = SlidingWindowLimiter(RATE_LIMITS)
+dedup = UpdateDedup(db, DEDUP_CACHE)
+# прохід веде один воркер; лізинг короткий і продовжується між порціями
+retention = Retention(db, ARCHIVE_PATH, RETENTION_ARCHIVE, RETENTION_PURGE,
+                      lease=Lease(db, "retention", ttl=120), interval=RETENTION_INTERVAL)
+ingest = IngestQueue(tg_app.process_update, INGEST_WORKERS, INGEST_QUEUE) if INGEST_MODE == "queue" else None
 
 # ========= DB =========
+async def _table_columns(conn, table: str) -> set:
+    async with conn.execute(f"PRAGMA table_info({table})") as cur:
+        return {r[1] for r in await cur.fetchall()}
+
+async def m001_base_schema(conn):
+    # користувачі
+    await conn.execute("""CREATE TABLE IF NOT EXISTS users(
+        user_id INTEGER PRIMARY KEY,
+        trust INT DEFAULT 0,
+        last_reset INT DEFAULT 0,
+        hourly_count INT DEFAULT 0,
+        seen_menu INT DEFAULT 0
+    )""")
+    # вхідні репорти
+    await conn.execute("""CREATE TABLE IF NOT EXISTS inbox(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        caption TEXT,
+        media_file_id TEXT,
+        media_type TEXT,
+        category TEXT,
+        ts INT,
+        location_lat REAL,
+        location_lon REAL,
+        location_text TEXT,
+        user_note TEXT,
+        admin_text_override TEXT,
+        admin_category_override TEXT
+    )""")
+    # старі бази (до user_version) могли не мати частини колонок
+    for table, col, decl in [
+        ("users", "seen_menu", "INT DEFAULT 0"),
+        ("inbox", "location_lat", "REAL"),
+        ("inbox", "location_lon", "REAL"),
+        ("inbox", "location_text", "TEXT"),
+        ("inbox", "user_note", "TEXT"),
+        ("inbox", "admin_text_override", "TEXT"),
+        ("inbox", "admin_category_override", "TEXT"),
+    ]:
+        if col not in await _table_columns(conn, table):
+            await conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+
+async def m002_inbox_indexes(conn):
+    # handle_category: WHERE user_id=? AND category='' ORDER BY id DESC LIMIT 1
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_inbox_user_cat ON inbox(user_id, category, id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_inbox_ts ON inbox(ts)")
+
+async def m003_outbox(conn):
+    # черга вихідних постів (канал, модерація) — див. outbox.py
+    await conn.execute("""CREATE TABLE IF NOT EXISTS outbox(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id TEXT,
+        method TEXT,
+        payload TEXT,
+        created INT,
+        next_try INT DEFAULT 0,
+        attempts INT DEFAULT 0,
+        status TEXT DEFAULT 'pending',
+        last_error TEXT
+    )""")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(status, next_try, id)")
+
+async def m004_shared_state(conn):
+    # стан кроків діалогу, спільний для всіх воркерів — див. state.py
+    await conn.execute("""CREATE TABLE IF NOT EXISTS conv_state(
+        scope TEXT,
+        key TEXT,
+        value TEXT,
+        updated INT,
+        PRIMARY KEY(scope, key)
+    ) WITHOUT ROWID""")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_conv_state_updated ON conv_state(updated)")
+    # хто з процесів зараз веде фонову задачу (напр. відправник outbox)
+    await conn.execute("""CREATE TABLE IF NOT EXISTS leases(
+        name TEXT PRIMARY KEY,
+        owner TEXT,
+        expires INT
+    )""")
+
+async def m005_albums(conn):
+    # альбом = один репорт; inbox.media_* — перше медіа, усі елементи — в inbox_media
+    await conn.execute("ALTER TABLE inbox ADD COLUMN media_group_id TEXT")
+    await conn.execute("ALTER TABLE inbox ADD COLUMN media_count INT DEFAULT 1")
+    await conn.execute("""CREATE TABLE IF NOT EXISTS inbox_media(
+        inbox_id INTEGER,
+        idx INT,
+        file_id TEXT,
+        media_type TEXT,
+        PRIMARY KEY(inbox_id, idx)
+    ) WITHOUT ROWID""")
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_inbox_media_group ON inbox(media_group_id) WHERE media_group_id IS NOT NULL"
+    )
+
+async def m006_media_dedup(conn):
+    # file_unique_id -> перший репорт з цим медіа; пошук дубліката = один lookup по PK
+    await conn.execute("ALTER TABLE inbox ADD COLUMN media_unique_id TEXT")
+    await conn.execute("ALTER TABLE inbox ADD COLUMN dup_count INT DEFAULT 0")
+    await conn.execute("ALTER TABLE inbox_media ADD COLUMN file_unique_id TEXT")
+    await conn.execute("""CREATE TABLE IF NOT EXISTS media_uid(
+        file_unique_id TEXT PRIMARY KEY,
+        inbox_id INTEGER
+    ) WITHOUT ROWID""")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_inbox_dups ON inbox(dup_count) WHERE dup_count>0")
+
+# сітка гарячих точок: 500 клітинок на градус ≈ 220×150 м у Запоріжжі (розмір перехрестя).
+# Зашита в тригери m007 — змінювати лише новою міграцією з перерахунком geo_cells.
+GEO_CELLS_PER_DEG = 500
+GEO_CATEGORY_SQL = "COALESCE(NULLIF({r}.admin_category_override,''), {r}.category)"
+
+def _geo_cell_upsert(r: str, delta: int) -> str:
+    cat = GEO_CATEGORY_SQL.format(r=r)
+    return (
+        "INSERT INTO geo_cells(day, category, cell_lat, cell_lon, n) "
+        f"SELECT {r}.ts/86400, {cat}, CAST({r}.location_lat*{GEO_CELLS_PER_DEG} AS INT), "
+        f"CAST({r}.location_lon*{GEO_CELLS_PER_DEG} AS INT), {delta} "
+        f"WHERE {r}.location_lat IS NOT NULL AND {r}.location_lon IS NOT NULL AND {cat}!='' "
+        f"ON CONFLICT(day, category, cell_lat, cell_lon) DO UPDATE SET n=n+({delta});"
+    )
+
+async def m007_geo_index(conn):
+    # R*Tree по координатах репортів + попередньо агреговані лічильники по клітинках сітки;
+    # обидва підтримуються тригерами на inbox, тож /nearby і /hotspots не сканують inbox
+    await conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS inbox_geo USING rtree(id, min_lat, max_lat, min_lon, max_lon)")
+    await conn.execute("""CREATE TABLE IF NOT EXISTS geo_cells(
+        day INT,
+        category TEXT,
+        cell_lat INT,
+        cell_lon INT,
+        n INT DEFAULT 0,
+        PRIMARY KEY(day, category, cell_lat, cell_lon)
+    ) WITHOUT ROWID""")
+    geo_insert = (
+        "INSERT INTO inbox_geo(id, min_lat, max_lat, min_lon, max_lon) "
+        "SELECT NEW.id, NEW.location_lat, NEW.location_lat, NEW.location_lon, NEW.location_lon "
+        "WHERE NEW.location_lat IS NOT NULL AND NEW.location_lon IS NOT NULL;"
+    )
+    await conn.execute(f"CREATE TRIGGER IF NOT EXISTS inbox_geo_ai AFTER INSERT ON inbox BEGIN "
+                       f"{geo_insert} {_geo_cell_upsert('NEW', 1)} END")
+    await conn.execute(f"CREATE TRIGGER IF NOT EXISTS inbox_geo_au AFTER UPDATE OF location_lat, location_lon ON inbox BEGIN "
+                       f"DELETE FROM inbox_geo WHERE id=OLD.id; {geo_insert} END")
+    await conn.execute(f"CREATE TRIGGER IF NOT EXISTS inbox_cells_au "
+                       f"AFTER UPDATE OF location_lat, location_lon, category, admin_category_override ON inbox BEGIN "
+                       f"{_geo_cell_upsert('OLD', -1)} {_geo_cell_upsert('NEW', 1)} END")
+    await conn.execute("CREATE TRIGGER IF NOT EXISTS inbox_geo_ad AFTER DELETE ON inbox BEGIN "
+                       "DELETE FROM inbox_geo WHERE id=OLD.id; END")
+    # наявні координати
+    await conn.execute(
+        "INSERT INTO inbox_geo(id, min_lat, max_lat, min_lon, max_lon) "
+        "SELECT id, location_lat, location_lat, location_lon, location_lon FROM inbox "
+        "WHERE location_lat IS NOT NULL AND location_lon IS NOT NULL"
+    )
+    cat = GEO_CATEGORY_SQL.format(r="inbox")
+    await conn.execute(
+        "INSERT INTO geo_cells(day, category, cell_lat, cell_lon, n) "
+        f"SELECT ts/86400, {cat}, CAST(location_lat*{GEO_CELLS_PER_DEG} AS INT), "
+        f"CAST(location_lon*{GEO_CELLS_PER_DEG} AS INT), COUNT(*) FROM inbox "
+        f"WHERE location_lat IS NOT NULL AND location_lon IS NOT NULL AND {cat}!='' GROUP BY 1, 2, 3, 4"
+    )
+
+async def m008_stats_rollup(conn):
+    # /stats і GET /stats читають лише звідси — ціна запиту не залежить від розміру inbox
+    await conn.execute("""CREATE TABLE IF NOT EXISTS stats_daily(
+        day INT,
+        category TEXT,
+        outcome TEXT,
+        n INT DEFAULT 0,
+        wait_s INT DEFAULT 0,
+        PRIMARY KEY(day, category, outcome)
+    ) WITHOUT ROWID""")
+    # історія, яку ще можна відновити з inbox
+    await conn.execute(
+        "INSERT INTO stats_daily(day, category, outcome, n) "
+        "SELECT ts/86400, '', 'received', COUNT(*) FROM inbox GROUP BY 1 "
+        "ON CONFLICT(day, category, outcome) DO UPDATE SET n=n+excluded.n"
+    )
+    await conn.execute(
+        "INSERT INTO stats_daily(day, category, outcome, n) "
+        "SELECT ts/86400, category, 'categorized', COUNT(*) FROM inbox WHERE category!='' GROUP BY 1, 2 "
+        "ON CONFLICT(day, category, outcome) DO UPDATE SET n=n+excluded.n"
+    )
+
+FTS_COLUMNS = "caption, user_note, location_text, admin_text_override"
+
+async def m009_fulltext(conn):
+    # FTS5 з external content: тексти не дублюються, індекс синхронізують тригери
+    await conn.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS inbox_fts USING fts5({FTS_COLUMNS}, "
+        "content='inbox', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+    )
+    new_vals = "new.caption, new.user_note, new.location_text, new.admin_text_override"
+    old_vals = "old.caption, old.user_note, old.location_text, old.admin_text_override"
+    await conn.execute(f"CREATE TRIGGER IF NOT EXISTS inbox_fts_ai AFTER INSERT ON inbox BEGIN "
+                       f"INSERT INTO inbox_fts(rowid, {FTS_COLUMNS}) VALUES(new.id, {new_vals}); END")
+    await conn.execute(f"CREATE TRIGGER IF NOT EXISTS inbox_fts_ad AFTER DELETE ON inbox BEGIN "
+                       f"INSERT INTO inbox_fts(inbox_fts, rowid, {FTS_COLUMNS}) VALUES('delete', old.id, {old_vals}); END")
+    await conn.execute(f"CREATE TRIGGER IF NOT EXISTS inbox_fts_au AFTER UPDATE OF {FTS_COLUMNS} ON inbox BEGIN "
+                       f"INSERT INTO inbox_fts(inbox_fts, rowid, {FTS_COLUMNS}) VALUES('delete', old.id, {old_vals}); "
+                       f"INSERT INTO inbox_fts(rowid, {FTS_COLUMNS}) VALUES(new.id, {new_vals}); END")
+    await conn.execute("INSERT INTO inbox_fts(inbox_fts) VALUES('rebuild')")
+
+async def m010_moderation_status(conn):
+    # draft → pending (на модерації) → approved/rejected → published (outbox відправив)
+    await conn.execute("ALTER TABLE inbox ADD COLUMN status TEXT DEFAULT 'draft'")
+    await conn.execute("ALTER TABLE inbox ADD COLUMN decided_ts INT")
+    # для старих категоризованих записів результат невідомий
+    await conn.execute("UPDATE inbox SET status='legacy' WHERE category!=''")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_inbox_status ON inbox(status, id)")
+    await conn.execute("ALTER TABLE outbox ADD COLUMN ref INTEGER")
+
+async def m011_meta(conn):
+    # дрібні службові значення (кеш getMe тощо)
+    await conn.execute("CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value TEXT)")
+
+async def m012_seen_updates(conn):
+    # update_id, які вже взято в обробку — див. dedup.py
+    await conn.execute("CREATE TABLE IF NOT EXISTS seen_updates(update_id INTEGER PRIMARY KEY, ts INT)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_seen_updates_ts ON seen_updates(ts)")
+
+# порядок = версія схеми; нові кроки лише дописуються в кінець
+MIGRATIONS = [
+    m001_base_schema,
+    m002_inbox_indexes,
+    m003_outbox,
+    m004_shared_state,
+    m005_albums,
+    m006_media_dedup,
+    m007_geo_index,
+    m008_stats_rollup,
+    m009_fulltext,
+    m010_moderation_status,
+    m011_meta,
+    m012_seen_updates,
+]
+
 async def init_db():
-    async with aiosqlite.connect("bot.db") as db:
-        # користувачі
-        await db.execute("""CREATE TABLE IF NOT EXISTS users(
-            user_id INTEGER PRIMARY KEY,
-            trust INT DEFAULT 0,
-            last_reset INT DEFAULT 0,
-            hourly_count INT DEFAULT 0,
-            seen_menu INT DEFAULT 0
-        )""")
-        # вхідні репорти
-        await db.execute("""CREATE TABLE IF NOT EXISTS inbox(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            caption TEXT,
-            media_file_id TEXT,
-            media_type TEXT,
-            category TEXT,
-            ts INT,
-            location_lat REAL,
-            location_lon REAL,
-            location_text TEXT,
-            user_note TEXT,
-            admin_text_override TEXT,
-            admin_category_override TEXT
-        )""")
-        # ідемпотентні міграції
-        for ddl in [
-            "ALTER TABLE users ADD COLUMN seen_menu INT DEFAULT 0",
-            "ALTER TABLE inbox ADD COLUMN location_lat REAL",
-            "ALTER TABLE inbox ADD COLUMN location_lon REAL",
-            "ALTER TABLE inbox ADD COLUMN location_text TEXT",
-            "ALTER TABLE inbox ADD COLUMN user_note TEXT",
-            "ALTER TABLE inbox ADD COLUMN admin_text_override TEXT",
-            "ALTER TABLE inbox ADD COLUMN admin_category_override TEXT",
-        ]:
-            try:
-                await db.execute(ddl)
-            except:
-                pass
-        await db.commit()
+    await db.migrate(MIGRATIONS)
 
 # ========= HELPERS =========
 def category_keyboard(prefix="cat", for_rec_id=None):
@@ -106,15 +363,12 @@ def detail_menu_kb(has_loc: bool, has_note: bool, rec_id: int):
         [InlineKeyboardButton("➡️ Далі", callback_data=f"det|done|{rec_id}")]
     ])
 
-async def ensure_user(uid: int):
-    async with aiosqlite.connect("bot.db") as db:
-        cur = await db.execute("SELECT user_id FROM users WHERE user_id=?", (uid,))
-        if not await cur.fetchone():
-            await db.execute(
-                "INSERT INTO users(user_id, trust, last_reset, hourly_count, seen_menu) VALUES(?,?,?,?,?)",
-                (uid, 0, int(time.time()), 0, 0)
-            )
-            await db.commit()
+async def ensure_user(uid: int) -> dict:
+    # профіль з кешу; новий користувач потрапить у БД з найближчим флашем
+    return await users.get(uid)
+
+def is_admin_chat(chat_id) -> bool:
+    return bool(ADMIN_CHAT_ID) and str(chat_id) == str(int(ADMIN_CHAT_ID))
 
 def resolve_chat_id(val: str):
     v = (val or "").strip()
@@ -123,12 +377,101 @@ def resolve_chat_id(val: str):
         except: pass
     return v  # @username або рядок
 
-async def publish_to_channel(context: ContextTypes.DEFAULT_TYPE, mtype: str, file_id: str, text: str):
-    chat = resolve_chat_id(CHANNEL_ID)
+async def send_media(chat_id, mtype: str, file_id: str, text: str, kb=None, conn=None, ref=None):
+    # через outbox: відправка піде у фоні з урахуванням лімітів Telegram
     if mtype == "photo":
-        await context.bot.send_photo(chat_id=chat, photo=file_id, caption=text)
+        await outbox.enqueue(chat_id, "send_photo", conn, ref, photo=file_id, caption=text, reply_markup=kb)
     else:
-        await context.bot.send_video(chat_id=chat, video=file_id, caption=text)
+        await outbox.enqueue(chat_id, "send_video", conn, ref, video=file_id, caption=text, reply_markup=kb)
+
+async def send_report_media(chat_id, rec_id: int, mtype: str, file_id: str, media_count: int, text: str,
+                            kb=None, conn=None, ref=None):
+    if (media_count or 1) <= 1:
+        await send_media(chat_id, mtype, file_id, text, kb, conn, ref)
+        return
+    # альбом — одним send_media_group; кнопки до альбому не чіпляються, тож окремим повідомленням
+    items = await db.fetchall("SELECT media_type, file_id FROM inbox_media WHERE inbox_id=? ORDER BY idx", (rec_id,))
+    media = [{"type": t, "media": f} for t, f in items[:10]]
+    media[0]["caption"] = text
+    await outbox.enqueue(chat_id, "send_media_group", conn, ref, media=media)
+    if kb is not None:
+        await outbox.enqueue(chat_id, "send_message", conn, text=text.split("\n", 1)[0] + f" (#{rec_id}, {len(media)} медіа)",
+                             reply_markup=kb)
+
+async def publish_to_channel(rec_id: int, mtype: str, file_id: str, media_count: int, text: str, conn=None):
+    # ref: після фактичної відправки outbox переведе репорт у status='published'
+    await send_report_media(resolve_chat_id(CHANNEL_ID), rec_id, mtype, file_id, media_count, text, conn=conn, ref=rec_id)
+
+async def mark_published(conn, rec_id: int):
+    await conn.execute("UPDATE inbox SET status='published' WHERE id=? AND status='approved'", (rec_id,))
+
+async def decide_report(conn, rec_id: int, row, approve: bool) -> bool:
+    # умовний UPDATE: повторне натискання / паралельний модератор нічого не зроблять
+    cur = await conn.execute(
+        "UPDATE inbox SET status=?, decided_ts=? WHERE id=? AND status IN ('pending','legacy')",
+        ("approved" if approve else "rejected", int(time.time()), rec_id)
+    )
+    if cur.rowcount == 0:
+        return False
+    category = row[10] or row[4]
+    if approve:
+        await publish_to_channel(rec_id, row[3], row[2], row[11], report_text(row), conn)
+    await bump_stats(conn, category, "approved" if approve else "rejected", rec_id)
+    return True
+
+async def notify_moderators_digest(conn):
+    # одне повідомлення «є нові репорти» на MOD_DIGEST_S замість поста на кожен репорт;
+    # рядок у leases працює як спільний для всіх воркерів таймер
+    now = int(time.time())
+    cur = await conn.execute(
+        "INSERT INTO leases(name, owner, expires) VALUES('mod_digest', '', ?) "
+        "ON CONFLICT(name) DO UPDATE SET expires=excluded.expires WHERE leases.expires<?",
+        (now + MOD_DIGEST_S, now)
+    )
+    if cur.rowcount > 0:
+        await outbox.enqueue(int(ADMIN_CHAT_ID), "send_message", conn,
+                             text="🔎 Є нові репорти на модерації — /queue")
+
+# ===== Статистика: інкрементні лічильники day × category × outcome =====
+# outcome: received, duplicate, categorized, moderation, auto, approved, rejected.
+# Для approved/rejected wait_s накопичує секунди від надходження репорту до рішення.
+async def bump_stats(conn, category: str, outcome: str, rec_id: int | None = None):
+    day = int(time.time()) // 86400
+    if rec_id is None:
+        await conn.execute(
+            "INSERT INTO stats_daily(day, category, outcome, n, wait_s) VALUES(?,?,?,1,0) "
+            "ON CONFLICT(day, category, outcome) DO UPDATE SET n=n+1",
+            (day, category or "", outcome)
+        )
+    else:
+        await conn.execute(
+            "INSERT INTO stats_daily(day, category, outcome, n, wait_s) "
+            "SELECT ?, ?, ?, 1, MAX(?-ts, 0) FROM inbox WHERE id=? "
+            "ON CONFLICT(day, category, outcome) DO UPDATE SET n=n+1, wait_s=wait_s+excluded.wait_s",
+            (day, category or "", outcome, int(time.time()), rec_id)
+        )
+
+async def read_stats(days: int) -> dict:
+    since = int(time.time()) // 86400 - days
+    rows = await db.fetchall(
+        "SELECT category, outcome, SUM(n), SUM(wait_s) FROM stats_daily WHERE day>? GROUP BY category, outcome",
+        (since,)
+    )
+    per_cat, totals, wait = {}, {}, 0
+    for cat, outcome, n, wait_s in rows:
+        if cat:
+            per_cat.setdefault(cat, {})[outcome] = n
+        totals[outcome] = totals.get(outcome, 0) + n
+        if outcome in ("approved", "rejected"):
+            wait += wait_s or 0
+    decided = totals.get("approved", 0) + totals.get("rejected", 0)
+    return {
+        "days": days,
+        "totals": totals,
+        "categories": per_cat,
+        "approve_ratio": round(totals.get("approved", 0) / decided, 3) if decided else None,
+        "avg_moderation_s": round(wait / decided) if decided else None,
+    }
 
 async def edit_q_message(q: "telegram.CallbackQuery", text: str, kb=None):
     try:
@@ -139,15 +482,46 @@ async def edit_q_message(q: "telegram.CallbackQuery", text: str, kb=None):
     except Exception:
         pass
 
+INBOX_REC_FIELDS = (
+    "user_id", "caption", "media_file_id", "media_type", "category",
+    "location_lat", "location_lon", "location_text", "user_note",
+    "admin_text_override", "admin_category_override", "media_count",
+)
+INBOX_REC_COLUMNS = ", ".join(INBOX_REC_FIELDS)
+
 async def get_inbox_rec(rec_id: int):
-    async with aiosqlite.connect("bot.db") as db:
-        cur = await db.execute(
-            "SELECT user_id, caption, media_file_id, media_type, category,"
-            " location_lat, location_lon, location_text, user_note,"
-            " admin_text_override, admin_category_override "
-            "FROM inbox WHERE id=?", (rec_id,)
-        )
-        return await cur.fetchone()
+    return await db.fetchone(f"SELECT {INBOX_REC_COLUMNS} FROM inbox WHERE id=?", (rec_id,))
+
+# чернетки майстра деталей — у памʼяті до передачі на публікацію/модерацію, див. drafts.py
+drafts = DraftStore(db, INBOX_REC_FIELDS, DRAFT_TTL)
+
+def draft_flags(d) -> tuple[bool, bool]:
+    v = d.values
+    has_loc = bool(v["location_lat"] and v["location_lon"]) or bool(v["location_text"])
+    return has_loc, bool(v["user_note"])
+
+def report_text(row, author: str | None = None) -> str:
+    # row — як із get_inbox_rec
+    _, caption, _, _, category, lat, lon, loc_text, user_note, admin_text_override, admin_cat_override = row[:11]
+    final_category = admin_cat_override or category
+    parts = [
+        "🚗 Порушення ПДР | Запоріжжя",
+        f"🗂 Категорія: {final_category}",
+        f"🧾 {PDR_MAP.get(final_category,'ПДР: (уточнити)')}",
+    ]
+    if author:
+        parts.append(f"👤 Від: {author}")
+    if (lat is not None and lon is not None):
+        parts.append(f"📍 Локація: https://maps.google.com/?q={lat:.6f},{lon:.6f}")
+    elif loc_text:
+        parts.append(f"📍 Локація: {loc_text}")
+    if user_note:
+        parts.append(f"📝 Примітка: {user_note}")
+    cap = admin_text_override if admin_text_override else caption
+    if cap:
+        parts.append("")
+        parts.append(cap)
+    return "\n".join(parts)
 
 async def send_main_menu(chat_id, context: ContextTypes.DEFAULT_TYPE):
     kb = InlineKeyboardMarkup([
@@ -168,6 +542,64 @@ async def send_main_menu(chat_id, context: ContextTypes.DEFAULT_TYPE):
         pass
 
 # ========= HANDLERS =========
+# ліміт частоти — група -1, виконується перед усіма хендлерами
+def hourly_quota_ok(uid: int) -> bool:
+    # годинний лічильник живе в кеші users (hourly_count/last_reset) і флашиться разом із ним;
+    # холодного користувача не читаємо з БД — його завантажить сам хендлер
+    row = users.peek(uid)
+    if row is None or RATE_HOURLY <= 0:
+        return True
+    now = int(time.time())
+    if now - row["last_reset"] >= 3600:
+        row["last_reset"], row["hourly_count"] = now, 0
+    if row["hourly_count"] >= RATE_HOURLY:
+        return False
+    row["hourly_count"] += 1
+    users.touch(uid, row)
+    return True
+
+async def rate_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user, chat = update.effective_user, update.effective_chat
+    if not user:
+        return
+    if chat and is_admin_chat(chat.id):
+        return
+    msg, group = update.message, None
+    if update.callback_query:
+        kind = "callback"
+    elif msg and (msg.photo or msg.video):
+        kind, group = "media", msg.media_group_id
+    elif msg:
+        kind = "text"
+    else:
+        return
+    new_report = kind == "media" and not limiter.same_group(user.id, kind, group)
+    verdict = limiter.hit(user.id, kind, group)
+    if verdict == OK and new_report:
+        if hourly_quota_ok(user.id):
+            limiter.clear(user.id, "hourly")
+        else:
+            verdict = limiter.block(user.id, "hourly")
+            limiter.mark_group(user.id, kind, group, verdict)
+    if verdict == OK:
+        return
+    if verdict == WARN:
+        try:
+            if update.callback_query:
+                await update.callback_query.answer("⏳ Забагато дій. Зачекайте хвилинку.")
+            else:
+                await msg.reply_text("⏳ Забагато повідомлень. Спробуйте трохи пізніше.")
+        except Exception:
+            pass
+    raise ApplicationHandlerStop
+
+async def dedup_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # повторна доставка того самого апдейту — лише підтверджуємо. Після rate_gate:
+    # флуд понад ліміт відкидається раніше й до БД не доходить
+    if not await dedup.claim(update.update_id):
+        metrics.WEBHOOK_SKIPPED.inc("duplicate")
+        raise ApplicationHandlerStop
+
 # /start + deep-link ?start=report
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args and len(context.args) > 0 and context.args[0].lower() == "report":
@@ -203,23 +635,114 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     await ensure_user(user.id)
 
-    async with aiosqlite.connect("bot.db") as db:
-        caption = (update.message.caption or "").strip()
-        if update.message.photo:
-            file_id, mtype = update.message.photo[-1].file_id, "photo"
-        elif update.message.video:
-            file_id, mtype = update.message.video.file_id, "video"
-        else:
-            await update.message.reply_text("📎 Надішліть фото або відео, не документ.")
-            return
-        await db.execute(
-            "INSERT INTO inbox(user_id,caption,media_file_id,media_type,category,ts) VALUES(?,?,?,?,?,?)",
-            (user.id, caption, file_id, mtype, "", int(time.time()))
-        )
-        await db.commit()
+    caption = (update.message.caption or "").strip()
+    if update.message.photo:
+        media, mtype = update.message.photo[-1], "photo"
+    elif update.message.video:
+        media, mtype = update.message.video, "video"
+    else:
+        await update.message.reply_text("📎 Надішліть фото або відео, не документ.")
+        return
+    file_id, unique_id = media.file_id, media.file_unique_id
+    if update.message.media_group_id:
+        # частина альбому — збираємо, один запис і одне питання про категорію
+        albums.add(update.message.media_group_id, user.id, update.effective_chat.id, caption, file_id, mtype, unique_id)
+        return
+    async with db.tx() as conn:
+        dup = await find_duplicate(conn, [unique_id])
+        if dup and not is_own_draft(dup, user.id):
+            await conn.execute("UPDATE inbox SET dup_count=dup_count+1 WHERE id=?", (dup[0],))
+            await bump_stats(conn, dup[2], "duplicate")
+        elif not dup:
+            cur = await conn.execute(
+                "INSERT INTO inbox(user_id,caption,media_file_id,media_type,category,ts,media_unique_id)"
+                " VALUES(?,?,?,?,?,?,?)",
+                (user.id, caption, file_id, mtype, "", int(time.time()), unique_id)
+            )
+            await conn.execute("INSERT OR IGNORE INTO media_uid(file_unique_id, inbox_id) VALUES(?,?)",
+                               (unique_id, cur.lastrowid))
+            await bump_stats(conn, "", "received")
+    if not dup:
+        drafts.put(cur.lastrowid, user_id=user.id, caption=caption, media_file_id=file_id, media_type=mtype,
+                   category="", media_count=1)
+    if dup and not is_own_draft(dup, user.id):
+        await update.message.reply_text(duplicate_text(dup[0]))
+        return
 
     await update.message.reply_text("🚦 Оберіть категорію:", reply_markup=category_keyboard("cat"))
 
+# ===== Дублікати (file_unique_id стабільний між користувачами, на відміну від file_id) =====
+async def find_duplicate(conn, unique_ids):
+    # -> (inbox_id, user_id, category) або None
+    ids = [u for u in unique_ids if u]
+    if not ids:
+        return None
+    async with conn.execute(
+        "SELECT i.id, i.user_id, i.category FROM media_uid m JOIN inbox i ON i.id=m.inbox_id "
+        f"WHERE m.file_unique_id IN ({','.join('?' * len(ids))}) LIMIT 1", ids
+    ) as cur:
+        return await cur.fetchone()
+
+def duplicate_text(rec_id: int) -> str:
+    return f"♻️ Це медіа вже надсилали (репорт #{rec_id}). Дублікат враховано — дякуємо!"
+
+def is_own_draft(dup, uid: int) -> bool:
+    # власна ще не завершена чернетка — не дублікат, просто повторно питаємо категорію
+    return dup[1] == uid and dup[2] == ""
+
+async def save_album(album: dict):
+    mgid, items = album["media_group_id"], album["items"]
+    dup = None
+    async with db.tx() as conn:
+        # частину альбому міг уже зберегти інший воркер — дописуємо до нього. Таймери
+        # воркерів спрацьовують майже одночасно: IMMEDIATE бере лок запису до SELECT,
+        # тож другий чекає коміту першого (busy_timeout) і бачить його рядок
+        await conn.execute("BEGIN IMMEDIATE")
+        async with conn.execute("SELECT id, media_count FROM inbox WHERE media_group_id=?", (mgid,)) as cur:
+            existing = await cur.fetchone()
+        if existing:
+            rec_id, start = existing
+            await conn.execute("UPDATE inbox SET media_count=media_count+? WHERE id=?", (len(items), rec_id))
+        else:
+            dup = await find_duplicate(conn, [u for _, _, u in items])
+            if dup:
+                if not is_own_draft(dup, album["user_id"]):
+                    await conn.execute("UPDATE inbox SET dup_count=dup_count+1 WHERE id=?", (dup[0],))
+                    await bump_stats(conn, dup[2], "duplicate")
+                items = []
+            else:
+                mtype, file_id, unique_id = items[0]
+                cur = await conn.execute(
+                    "INSERT INTO inbox(user_id,caption,media_file_id,media_type,category,ts,"
+                    "media_group_id,media_count,media_unique_id) VALUES(?,?,?,?,?,?,?,?,?)",
+                    (album["user_id"], album["caption"], file_id, mtype, "", int(time.time()),
+                     mgid, len(items), unique_id)
+                )
+                rec_id, start = cur.lastrowid, 0
+                await bump_stats(conn, "", "received")
+                drafts.put(rec_id, user_id=album["user_id"], caption=album["caption"], media_file_id=file_id,
+                           media_type=mtype, category="", media_count=len(items))
+        if items:
+            await conn.executemany(
+                "INSERT INTO inbox_media(inbox_id, idx, file_id, media_type, file_unique_id) VALUES(?,?,?,?,?)",
+                [(rec_id, start + i, f, t, u) for i, (t, f, u) in enumerate(items)]
+            )
+            await conn.executemany(
+                "INSERT OR IGNORE INTO media_uid(file_unique_id, inbox_id) VALUES(?,?)",
+                [(u, rec_id) for _, _, u in items if u]
+            )
+    if existing:
+        # media_count змінився в БД — закешована чернетка застаріла
+        await drafts.evict(rec_id)
+        return
+    if dup and not is_own_draft(dup, album["user_id"]):
+        await tg_app.bot.send_message(chat_id=album["chat_id"], text=duplicate_text(dup[0]))
+        return
+    await tg_app.bot.send_message(chat_id=album["chat_id"], text="🚦 Оберіть категорію:",
+                                  reply_markup=category_keyboard("cat"))
+
+albums = AlbumCollector(save_album, ALBUM_WINDOW)
+
 # вибір категорії користувачем
 async def handle_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -232,21 +755,23 @@ async def handle_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await edit_q_message(q, "⚠️ Невідома категорія.")
         return
 
-    async with aiosqlite.connect("bot.db") as db:
-        cur = await db.execute(
-            "SELECT id,caption,media_file_id,media_type,location_lat,location_lon,location_text,user_note "
-            "FROM inbox WHERE user_id=? AND category='' ORDER BY id DESC LIMIT 1", (uid,)
-        )
-        row = await cur.fetchone()
-        if not row:
-            await edit_q_message(q, "⚠️ Немає медіа для категоризації. Спробуйте ще раз.")
-            return
-        rec_id = row[0]
-        await db.execute("UPDATE inbox SET category=? WHERE id=?", (category, rec_id))
-        await db.commit()
+    # остання чернетка користувача — з памʼяті; інакше (рестарт, інший воркер) — з БД
+    draft = drafts.last_for(uid)
+    if draft is None or draft.values["category"] != "":
+        row = await db.fetchone("SELECT id FROM inbox WHERE user_id=? AND category='' ORDER BY id DESC LIMIT 1", (uid,))
+        draft = await drafts.get(row[0]) if row else None
+    if not draft:
+        await edit_q_message(q, "⚠️ Немає медіа для категоризації. Спробуйте ще раз.")
+        return
+    rec_id = draft.rec_id
+    # контрольна точка: категорія (за нею шукають чернетки) — разом зі статистикою
+    async with db.tx() as conn:
+        cur = await conn.execute("UPDATE inbox SET category=? WHERE id=? AND category=''", (category, rec_id))
+        if cur.rowcount:
+            await bump_stats(conn, category, "categorized")
+    drafts.mark_saved(rec_id, category=category)
 
-    has_loc = bool(row[4] and row[5]) or bool(row[6])
-    has_note = bool(row[7])
+    has_loc, has_note = draft_flags(draft)
     await edit_q_message(
         q,
         "ℹ️ За бажанням додайте локацію та/або коментар. Потім натисніть «➡️ Далі».",
@@ -254,6 +779,29 @@ async def handle_category(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 # ===== Деталі репорту (локація/нотатка/фініш) =====
+ALREADY_SUBMITTED = "ℹ️ Цей репорт уже надіслано."
+
+async def leave_draft(conn, draft, status: str) -> bool:
+    # умовний UPDATE: повторне «➡️ Далі» (чи повтор апдейту) не опублікує репорт удруге.
+    # Контрольна точка: накопичені правки чернетки пишуться в тій самій транзакції.
+    cur = await conn.execute(
+        "UPDATE inbox SET status=?, decided_ts=? WHERE id=? AND status='draft'",
+        (status, int(time.time()) if status == "approved" else None, draft.rec_id)
+    )
+    if cur.rowcount == 0:
+        return False
+    await drafts.save(conn, draft)
+    return True
+
+async def show_detail_menu(q, rec_id: int):
+    draft = await drafts.get(rec_id)
+    if draft is None:
+        await edit_q_message(q, "❗ Запис не знайдено.")
+        return
+    has_loc, has_note = draft_flags(draft)
+    await edit_q_message(q, "ℹ️ Додайте деталі або тисніть «➡️ Далі».",
+                         kb=detail_menu_kb(has_loc, has_note, rec_id))
+
 async def det_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -261,58 +809,33 @@ async def det_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     rec_id = int(rec_s)
 
     if action == "loc":
-        context.user_data["await_loc_rec"] = rec_id
+        await state.set(user_scope(q.from_user.id), "await_loc_rec", rec_id)
         await q.message.reply_text(
             "📍 Надішліть геолокацію (Скріпка → Локація) АБО напишіть текст-адресу.\n"
             "Коли закінчите, знову натисніть «➡️ Далі»."
         )
-        row = await get_inbox_rec(rec_id)
-        has_loc = bool(row[5] and row[6]) or bool(row[7])
-        has_note = bool(row[8])
-        await edit_q_message(q, "ℹ️ Додайте деталі або тисніть «➡️ Далі».",
-                             kb=detail_menu_kb(has_loc, has_note, rec_id))
+        await show_detail_menu(q, rec_id)
         return
 
     if action == "note":
-        context.user_data["await_note_rec"] = rec_id
+        await state.set(user_scope(q.from_user.id), "await_note_rec", rec_id)
         await q.message.reply_text("📝 Надішліть текстовий коментар (номер авто, час, смуги тощо).")
-        row = await get_inbox_rec(rec_id)
-        has_loc = bool(row[5] and row[6]) or bool(row[7])
-        has_note = bool(row[8])
-        await edit_q_message(q, "ℹ️ Додайте деталі або тисніть «➡️ Далі».",
-                             kb=detail_menu_kb(has_loc, has_note, rec_id))
+        await show_detail_menu(q, rec_id)
         return
 
     if action == "done":
-        row = await get_inbox_rec(rec_id)
-        if not row:
+        draft = await drafts.get(rec_id)
+        if not draft:
             await edit_q_message(q, "❗ Запис не знайдено.")
             return
-        uid, caption, file_id, mtype, category, lat, lon, loc_text, user_note, admin_text_override, admin_cat_override = row
+        row = draft.row(INBOX_REC_FIELDS)
+        uid, caption, file_id, mtype, category, lat, lon, loc_text, user_note, admin_text_override, admin_cat_override, media_count = row
         uname = update.effective_user.username or "без_ніка"
-
         final_category = admin_cat_override or category
-        parts = [
-            "🚗 Порушення ПДР | Запоріжжя",
-            f"🗂 Категорія: {final_category}",
-            f"🧾 {PDR_MAP.get(final_category,'ПДР: (уточнити)')}",
-            f"👤 Від: @{uname} (id {uid})",
-        ]
-        if (lat is not None and lon is not None):
-            parts.append(f"📍 Локація: https://maps.google.com/?q={lat:.6f},{lon:.6f}")
-        elif loc_text:
-            parts.append(f"📍 Локація: {loc_text}")
-        if user_note:
-            parts.append(f"📝 Примітка: {user_note}")
-        cap = admin_text_override if admin_text_override else caption
-        if cap:
-            parts.append("")
-            parts.append(cap)
-        base_text = "\n".join(parts)
-
-        async with aiosqlite.connect("bot.db") as db:
-            cur = await db.execute("SELECT trust FROM users WHERE user_id=?", (uid,))
-            trust = (await cur.fetchone() or (0,))[0]
+        base_text = report_text(row, author=f"@{uname} (id {uid})")
+
+        # довіра — з БД: її міг підняти модератор через інший воркер
+        trust = await users.trust(uid)
 
         if TRUST_QUOTA > 0 and ADMIN_CHAT_ID and trust < TRUST_QUOTA:
             kb = InlineKeyboardMarkup([
@@ -326,75 +849,57 @@ async def det_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 ]
             ])
             adm_caption = "📝 На модерацію\n" + base_text
-            try:
-                if mtype == "photo":
-                    await tg_app.bot.send_photo(chat_id=int(ADMIN_CHAT_ID), photo=file_id, caption=adm_caption, reply_markup=kb)
-                else:
-                    await tg_app.bot.send_video(chat_id=int(ADMIN_CHAT_ID), video=file_id, caption=adm_caption, reply_markup=kb)
-            except:
-                pass
-            await edit_q_message(q, "🔎 Репорт надіслано на модерацію. Дякуємо!")
+            async with db.tx() as conn:
+                if done := await leave_draft(conn, draft, "pending"):
+                    if MOD_NOTIFY == "digest":
+                        await notify_moderators_digest(conn)
+                    else:
+                        await send_report_media(int(ADMIN_CHAT_ID), rec_id, mtype, file_id, media_count, adm_caption, kb, conn)
+                    await bump_stats(conn, final_category, "moderation")
+            drafts.drop(rec_id)
+            await edit_q_message(q, "🔎 Репорт надіслано на модерацію. Дякуємо!" if done else ALREADY_SUBMITTED)
             return
 
         try:
-            await publish_to_channel(context, mtype, file_id, base_text)
-            await edit_q_message(q, "✅ Опубліковано в канал. Дякуємо!")
+            async with db.tx() as conn:
+                if done := await leave_draft(conn, draft, "approved"):
+                    await publish_to_channel(rec_id, mtype, file_id, media_count, base_text, conn)
+                    await bump_stats(conn, final_category, "auto")
+            drafts.drop(rec_id)
+            await edit_q_message(q, "✅ Репорт поставлено в чергу публікації. Дякуємо!" if done else ALREADY_SUBMITTED)
         except Exception as e:
             await edit_q_message(q, f"❗ Не вдалося опублікувати: {e}")
 
 # ===== Прийом геолокації / адреси / нотатки =====
 async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if "await_loc_rec" not in context.user_data:
+    rec_id = await state.pop(user_scope(update.effective_user.id), "await_loc_rec")
+    if rec_id is None:
         return
-    rec_id = context.user_data.pop("await_loc_rec")
     loc = update.message.location
     if not loc:
         return
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute("UPDATE inbox SET location_lat=?, location_lon=?, location_text=NULL WHERE id=?",
-                         (loc.latitude, loc.longitude, rec_id))
-        await db.commit()
+    await drafts.update(rec_id, location_lat=loc.latitude, location_lon=loc.longitude, location_text=None)
     await update.message.reply_text("✅ Локацію збережено.")
 
-async def handle_text_while_waiting(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    # користувач дописує деталі
-    if update.message and (update.message.text is None):
-        return
-    text = (update.message.text or "").strip()
-    if not text:
-        return
-
-    if "await_loc_rec" in context.user_data:
-        rec_id = context.user_data.pop("await_loc_rec")
-        async with aiosqlite.connect("bot.db") as db:
-            await db.execute("UPDATE inbox SET location_text=?, location_lat=NULL, location_lon=NULL WHERE id=?",
-                             (text, rec_id))
-            await db.commit()
-        await update.message.reply_text("✅ Адресу збережено.")
-        return
+# користувач дописує деталі (текст маршрутизує route_text за очікуваним кроком)
+async def handle_address_text(update: Update, context: ContextTypes.DEFAULT_TYPE, rec_id: int):
+    await state.delete(user_scope(update.effective_user.id), "await_loc_rec")
+    await drafts.update(rec_id, location_text=update.message.text.strip(), location_lat=None, location_lon=None)
+    await update.message.reply_text("✅ Адресу збережено.")
 
-    if "await_note_rec" in context.user_data:
-        rec_id = context.user_data.pop("await_note_rec")
-        async with aiosqlite.connect("bot.db") as db:
-            await db.execute("UPDATE inbox SET user_note=? WHERE id=?", (text, rec_id))
-            await db.commit()
-        await update.message.reply_text("✅ Коментар збережено.")
-        return
+async def handle_note_text(update: Update, context: ContextTypes.DEFAULT_TYPE, rec_id: int):
+    await state.delete(user_scope(update.effective_user.id), "await_note_rec")
+    await drafts.update(rec_id, user_note=update.message.text.strip())
+    await update.message.reply_text("✅ Коментар збережено.")
 
 # ===== Авто-меню для новачків (без /start) =====
 async def auto_menu_fallback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if "await_loc_rec" in context.user_data or "await_note_rec" in context.user_data:
-        return
+    # route_text кличе лише тоді, коли жоден крок не очікується
     uid = update.effective_user.id
-    await ensure_user(uid)
-    async with aiosqlite.connect("bot.db") as db:
-        cur = await db.execute("SELECT seen_menu FROM users WHERE user_id=?", (uid,))
-        row = await cur.fetchone()
-        seen = (row[0] if row else 0)
-        if not seen:
-            await db.execute("UPDATE users SET seen_menu=1 WHERE user_id=?", (uid,))
-            await db.commit()
-            await send_main_menu(update.effective_chat.id, context)
+    profile = await ensure_user(uid)
+    if not profile["seen_menu"]:
+        await users.update(uid, seen_menu=1)
+        await send_main_menu(update.effective_chat.id, context)
 
 # ===== Модерація =====
 async def mod_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -407,50 +912,33 @@ async def mod_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not row:
         await edit_q_message(q, "Запис не знайдено.")
         return
-    uid, caption, file_id, mtype, category, lat, lon, loc_text, user_note, admin_text_override, admin_cat_override = row
+    uid, caption, file_id, mtype, category, lat, lon, loc_text, user_note, admin_text_override, admin_cat_override, media_count = row
 
     # ---- ПУБЛІКАЦІЯ
     if decision == "ok":
-        final_category = admin_cat_override or category
-        parts = [
-            "🚗 Порушення ПДР | Запоріжжя",
-            f"🗂 Категорія: {final_category}",
-            f"🧾 {PDR_MAP.get(final_category,'ПДР: (уточнити)')}",
-        ]
-        if (lat is not None and lon is not None):
-            parts.append(f"📍 Локація: https://maps.google.com/?q={lat:.6f},{lon:.6f}")
-        elif loc_text:
-            parts.append(f"📍 Локація: {loc_text}")
-        if user_note:
-            parts.append(f"📝 Примітка: {user_note}")
-        cap = admin_text_override if admin_text_override else caption
-        if cap:
-            parts.append("")
-            parts.append(cap)
-        text = "\n".join(parts)
-
         try:
-            await publish_to_channel(context, mtype, file_id, text)
+            async with db.tx() as conn:
+                done = await decide_report(conn, rec_id, row, approve=True)
+            if not done:
+                await edit_q_message(q, "ℹ️ Рішення щодо цього репорту вже ухвалено.")
+                return
             # апдейтимо довіру
-            async with aiosqlite.connect("bot.db") as db:
-                cur = await db.execute("SELECT trust FROM users WHERE user_id=?", (uid,))
-                trust = (await cur.fetchone() or (0,))[0]
-                new_trust = min(trust + 1, TRUST_QUOTA)
-                await db.execute("UPDATE users SET trust=? WHERE user_id=?", (new_trust, uid))
-                await db.commit()
-            await edit_q_message(q, f"✅ Опубліковано. Довіра користувача оновлена.")
+            await users.bump_trust(uid, TRUST_QUOTA)
+            await edit_q_message(q, f"✅ Поставлено в чергу публікації. Довіра користувача оновлена.")
         except Exception as e:
             await edit_q_message(q, f"❗ Не вдалося опублікувати: {e}\nПеревірте CHANNEL_ID та права бота.")
         return
 
     # ---- ВІДХИЛЕННЯ
     if decision == "no":
-        await edit_q_message(q, "❌ Відхилено.")
+        async with db.tx() as conn:
+            done = await decide_report(conn, rec_id, row, approve=False)
+        await edit_q_message(q, "❌ Відхилено." if done else "ℹ️ Рішення щодо цього репорту вже ухвалено.")
         return
 
     # ---- РЕДАГУВАННЯ ТЕКСТУ
     if decision == "edit":
-        context.user_data["admin_edit_rec"] = rec_id
+        await state.set(user_scope(q.from_user.id), "admin_edit_rec", rec_id)
         await q.message.reply_text("✏️ Надішліть новий текст (замінить початковий підпис/коментар користувача).")
         return
 
@@ -460,22 +948,11 @@ async def mod_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.message.reply_text("🔁 Оберіть нову категорію для публікації:", reply_markup=kb)
         return
 
-# приймаємо ТЕКСТ від адміна як правку
-async def admin_text_override_inbox(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not ADMIN_CHAT_ID:
-        return
-    if str(update.effective_chat.id) != str(int(ADMIN_CHAT_ID)):
-        return
-    if "admin_edit_rec" not in context.user_data:
-        return
-    new_text = (update.message.text or "").strip()
-    if not new_text:
-        await update.message.reply_text("Порожній текст. Спробуйте ще раз натиснувши «✏️ Редагувати текст».")
-        return
-    rec_id = context.user_data.pop("admin_edit_rec")
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute("UPDATE inbox SET admin_text_override=? WHERE id=?", (new_text, rec_id))
-        await db.commit()
+# приймаємо ТЕКСТ від адміна як правку (route_text — лише в чаті модераторів)
+async def admin_text_override_inbox(update: Update, context: ContextTypes.DEFAULT_TYPE, rec_id: int):
+    new_text = update.message.text.strip()
+    await state.delete(user_scope(update.effective_user.id), "admin_edit_rec")
+    await db.execute("UPDATE inbox SET admin_text_override=? WHERE id=?", (new_text, rec_id))
     await update.message.reply_text("✅ Текст відредаговано. Тисніть «✅ Опублікувати».")
 
 # приймаємо нову категорію від адміна
@@ -492,22 +969,19 @@ async def admin_recat_set(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not new_cat:
         await q.message.reply_text("Невірна категорія.")
         return
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute("UPDATE inbox SET admin_category_override=? WHERE id=?", (new_cat, rec_id))
-        await db.commit()
+    await db.execute("UPDATE inbox SET admin_category_override=? WHERE id=?", (new_cat, rec_id))
     await q.message.reply_text(f"✅ Категорію змінено на: {new_cat}. Тисніть «✅ Опублікувати».")
 
 # ===== Звернення до адміністратора =====
-ADMIN_MSG = 1001
-
 async def ask_admin_msg(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
+    await state.set(user_scope(q.from_user.id), "await_admin_msg", 1)
     await q.edit_message_text("✍️ Напишіть текст повідомлення адміністратору. Воно **не публікується** в каналі.")
-    return ADMIN_MSG
 
-async def handle_admin_msg_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    text = (update.message.text or "").strip()
+async def handle_admin_msg_text(update: Update, context: ContextTypes.DEFAULT_TYPE, _):
+    await state.delete(user_scope(update.effective_user.id), "await_admin_msg")
+    text = update.message.text.strip()
     if ADMIN_CHAT_ID:
         try:
             uname = update.effective_user.username or 'без_ніка'
@@ -520,50 +994,455 @@ async def handle_admin_msg_text(update: Update, context: ContextTypes.DEFAULT_TY
         except Exception as e:
             print("ADMIN DM ERROR:", e)
     await update.message.reply_text("✅ Повідомлення надіслано адміністратору. Дякуємо!")
-    return ConversationHandler.END
 
 # ===== Допоміжні команди =====
 async def chatid(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(f"chat_id: {update.effective_chat.id}")
 
+# /dups [rec_id] — скільки дублікатів зібрали репорти (лише в чаті модераторів)
+async def dups_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    if context.args:
+        try:
+            rec_id = int(context.args[0].lstrip("#"))
+        except ValueError:
+            await update.message.reply_text("Використання: /dups [id репорту]")
+            return
+        row = await db.fetchone("SELECT dup_count FROM inbox WHERE id=?", (rec_id,))
+        if not row:
+            await update.message.reply_text("Запис не знайдено.")
+            return
+        await update.message.reply_text(f"♻️ Репорт #{rec_id}: дублікатів {row[0] or 0}.")
+        return
+    rows = await db.fetchall(
+        "SELECT id, dup_count, category FROM inbox WHERE dup_count>0 ORDER BY dup_count DESC LIMIT 10"
+    )
+    if not rows:
+        await update.message.reply_text("♻️ Дублікатів поки немає.")
+        return
+    lines = ["♻️ Найбільше дублікатів:"]
+    lines += [f"#{rid} — {cnt} ({cat or 'без категорії'})" for rid, cnt, cat in rows]
+    await update.message.reply_text("\n".join(lines))
+
+# ===== Гарячі точки (лише в чаті модераторів) =====
+def maps_link(lat: float, lon: float) -> str:
+    return f"https://maps.google.com/?q={lat:.6f},{lon:.6f}"
+
+def distance_m(lat1, lon1, lat2, lon2) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+# /nearby <lat> <lon> [радіус_м] — репорти поруч з точкою
+async def nearby_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    try:
+        lat, lon = float(context.args[0]), float(context.args[1])
+        radius = float(context.args[2]) if len(context.args) > 2 else 300.0
+    except (IndexError, ValueError):
+        await update.message.reply_text("Використання: /nearby <lat> <lon> [радіус у метрах]")
+        return
+    radius = min(max(radius, 10.0), 20000.0)
+    dlat = radius / 111320
+    dlon = radius / (111320 * max(math.cos(math.radians(lat)), 0.01))
+    rows = await db.fetchall(
+        "SELECT i.id, i.location_lat, i.location_lon, COALESCE(NULLIF(i.admin_category_override,''), i.category), i.ts "
+        "FROM inbox_geo g JOIN inbox i ON i.id=g.id "
+        "WHERE g.max_lat>=? AND g.min_lat<=? AND g.max_lon>=? AND g.min_lon<=?",
+        (lat - dlat, lat + dlat, lon - dlon, lon + dlon)
+    )
+    hits = sorted(
+        (d, r) for r in rows if (d := distance_m(lat, lon, r[1], r[2])) <= radius
+    )
+    if not hits:
+        await update.message.reply_text(f"📍 У радіусі {radius:.0f} м репортів немає.")
+        return
+    lines = [f"📍 Репортів у радіусі {radius:.0f} м: {len(hits)}"]
+    for d, (rid, rlat, rlon, cat, ts) in hits[:15]:
+        lines.append(f"#{rid} · {d:.0f} м · {time.strftime('%d.%m.%Y', time.localtime(ts))} · {cat or 'без категорії'}")
+    await update.message.reply_text("\n".join(lines), disable_web_page_preview=True)
+
+# /hotspots [днів] [код категорії c1..c6] — найгарячіші клітинки сітки
+async def hotspots_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    days, category = 30, None
+    for arg in context.args or []:
+        if arg.isdigit():
+            days = min(int(arg), 3650)
+        elif arg in CATEGORY_MAP:
+            category = CATEGORY_MAP[arg]
+    since = int(time.time()) // 86400 - days
+    sql = ("SELECT cell_lat, cell_lon, category, SUM(n) AS cnt FROM geo_cells WHERE day>?"
+           + (" AND category=?" if category else "")
+           + " GROUP BY cell_lat, cell_lon, category HAVING cnt>0 ORDER BY cnt DESC LIMIT 10")
+    rows = await db.fetchall(sql, (since, category) if category else (since,))
+    if not rows:
+        await update.message.reply_text(f"🔥 За {days} дн. гарячих точок немає.")
+        return
+    lines = [f"🔥 Гарячі точки за {days} дн.:"]
+    for cell_lat, cell_lon, cat, cnt in rows:
+        c_lat = (cell_lat + 0.5) / GEO_CELLS_PER_DEG
+        c_lon = (cell_lon + 0.5) / GEO_CELLS_PER_DEG
+        lines.append(f"{cnt} × {cat}\n   {maps_link(c_lat, c_lon)}")
+    await update.message.reply_text("\n".join(lines), disable_web_page_preview=True)
+
+# ===== Пошук по підписах, коментарях, адресах (FTS5) =====
+SEARCH_PAGE = 10
+
+def fts_query(text: str) -> str:
+    # кожне слово — як префікс, усі слова обовʼязкові; лапки екранують синтаксис FTS
+    return " ".join(f'"{t}"*' for t in re.findall(r"\w+", text))
+
+async def render_search(query: str, page: int):
+    match = fts_query(query)
+    if not match:
+        return "Використання: /search <номер авто, вулиця, текст>", None
+    rows = await db.fetchall(
+        "SELECT i.id, i.ts, COALESCE(NULLIF(i.admin_category_override,''), i.category), "
+        "snippet(inbox_fts, -1, '«', '»', '…', 8) "
+        "FROM inbox_fts JOIN inbox i ON i.id=inbox_fts.rowid "
+        "WHERE inbox_fts MATCH ? ORDER BY bm25(inbox_fts) LIMIT ? OFFSET ?",
+        (match, SEARCH_PAGE + 1, page * SEARCH_PAGE)
+    )
+    if not rows:
+        return f"🔎 «{query}»: нічого не знайдено.", None
+    lines = [f"🔎 «{query}» — стор. {page + 1}"]
+    for rid, ts, cat, snip in rows[:SEARCH_PAGE]:
+        lines.append(f"#{rid} · {time.strftime('%d.%m.%Y', time.localtime(ts or 0))} · {cat or 'без категорії'}\n   {snip}")
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"srch|{page - 1}"))
+    if len(rows) > SEARCH_PAGE:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"srch|{page + 1}"))
+    return "\n".join(lines), (InlineKeyboardMarkup([nav]) if nav else None)
+
+# /search <запит> — лише в чаті модераторів; запит памʼятаємо в стані чату для гортання
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    query = " ".join(context.args or []).strip()
+    text, kb = await render_search(query, 0)
+    if kb:
+        await state.set(chat_scope(update.effective_chat.id), "search", query)
+    await update.message.reply_text(text, reply_markup=kb, disable_web_page_preview=True)
+
+async def search_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    if not is_admin_chat(q.message.chat.id):
+        return
+    query = (await state.load(chat_scope(q.message.chat.id))).get("search")
+    if not query:
+        await edit_q_message(q, "Пошук застарів — повторіть /search.")
+        return
+    text, kb = await render_search(query, max(int(q.data.split("|", 1)[1]), 0))
+    await edit_q_message(q, text, kb)
+
+# ===== Черга модерації: keyset-пагінація + масові рішення по сторінці =====
+async def render_queue(chat_id, after_id: int):
+    rows = await db.fetchall(
+        f"SELECT id, ts, {INBOX_REC_COLUMNS} FROM inbox WHERE status='pending' AND id>? ORDER BY id LIMIT ?",
+        (after_id, QUEUE_PAGE + 1)
+    )
+    if not rows:
+        return ("📋 Черга модерації порожня." if after_id == 0 else "📋 Далі репортів немає."), None
+    page, more = rows[:QUEUE_PAGE], len(rows) > QUEUE_PAGE
+    ids = [r[0] for r in page]
+    # сторінку запамʼятовуємо, щоб масова дія зачепила саме показані репорти; ключ один
+    # на чат — кожен показ перезаписує його, тож conv_state не росте з гортанням
+    await state.set(chat_scope(chat_id), "queue_page", ids)
+    lines = ["📋 Черга модерації:"]
+    for r in page:
+        rid, ts, rec = r[0], r[1], r[2:]
+        cat = rec[10] or rec[4]
+        flags = ("📍" if (rec[5] is not None or rec[7]) else "") + ("📝" if rec[8] else "")
+        media = f"{rec[11]}×" if (rec[11] or 1) > 1 else ""
+        text = (rec[9] or rec[1] or "").replace("\n", " ")
+        lines.append(f"#{rid} · {time.strftime('%d.%m %H:%M', time.localtime(ts or 0))} · {media}{rec[3]} · {cat} {flags}"
+                     + (f"\n   {text[:80]}" if text else ""))
+    span = f"{ids[0]}|{ids[-1]}"
+    kb = [[InlineKeyboardButton(f"✅ Схвалити всі ({len(ids)})", callback_data=f"qm|ok|{span}"),
+           InlineKeyboardButton("❌ Відхилити всі", callback_data=f"qm|no|{span}")]]
+    if more:
+        kb.append([InlineKeyboardButton("➡️ Далі", callback_data=f"qm|next|{ids[-1]}")])
+    return "\n".join(lines), InlineKeyboardMarkup(kb)
+
+# /queue — непереглянуті репорти сторінками (лише в чаті модераторів)
+async def queue_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    text, kb = await render_queue(update.effective_chat.id, 0)
+    await update.message.reply_text(text, reply_markup=kb)
+
+async def queue_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    chat_id = q.message.chat.id
+    if not is_admin_chat(chat_id):
+        return
+    parts = q.data.split("|")
+    if parts[1] == "next":
+        text, kb = await render_queue(chat_id, int(parts[2]))
+        await edit_q_message(q, text, kb)
+        return
+    first, last = int(parts[2]), int(parts[3])
+    ids = (await state.load(chat_scope(chat_id))).get("queue_page")
+    if not ids or (ids[0], ids[-1]) != (first, last):
+        # дія зі старішого повідомлення — запамʼятована вже інша сторінка
+        ids = [r[0] for r in await db.fetchall(
+            "SELECT id FROM inbox WHERE status='pending' AND id BETWEEN ? AND ? ORDER BY id LIMIT ?",
+            (first, last, QUEUE_PAGE)
+        )]
+    approve = parts[1] == "ok"
+    rows = await db.fetchall(
+        f"SELECT id, {INBOX_REC_COLUMNS} FROM inbox WHERE id IN ({','.join('?' * len(ids))}) AND status='pending'",
+        ids
+    ) if ids else []
+    # уся сторінка — одна транзакція: і статуси, і пости в outbox, і статистика
+    decided = []
+    async with db.tx() as conn:
+        for r in rows:
+            if await decide_report(conn, r[0], r[1:], approve):
+                decided.append(r)
+    if approve:
+        for r in decided:
+            await users.bump_trust(r[1], TRUST_QUOTA)
+    verb = "Схвалено" if approve else "Відхилено"
+    text, kb = await render_queue(chat_id, last)
+    await edit_q_message(q, f"{'✅' if approve else '❌'} {verb}: {len(decided)}.\n\n{text}", kb)
+
+# /vacuum — одноразово перевести наявну базу на auto_vacuum=INCREMENTAL (лише в чаті модераторів).
+# Повний VACUUM блокує запис на весь час і потребує вільного місця ще на одну базу —
+# запускати вручну в тиху годину; далі ретеншн звільняє місце малими кроками сам.
+async def vacuum_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    if (await db.fetchone("PRAGMA main.auto_vacuum"))[0] == 2:
+        await update.message.reply_text("🧹 База вже в режимі incremental vacuum.")
+        return
+    await update.message.reply_text("🧹 VACUUM запущено — запис у базу призупинено до завершення.")
+    t0 = time.perf_counter()
+    await db.enable_incremental_vacuum()
+    await update.message.reply_text(f"✅ Готово за {time.perf_counter() - t0:.1f} с. Далі місце звільняється поступово.")
+
+# /stats [днів] — зведення з rollup-таблиці (лише в чаті модераторів)
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin_chat(update.effective_chat.id):
+        return
+    days = 7
+    if context.args and context.args[0].isdigit():
+        days = min(max(int(context.args[0]), 1), 3650)
+    st = await read_stats(days)
+    t = st["totals"]
+    lines = [
+        f"📊 Статистика за {days} дн.",
+        f"Надійшло: {t.get('received', 0)} · дублікатів: {t.get('duplicate', 0)}",
+        f"На модерацію: {t.get('moderation', 0)} · без модерації: {t.get('auto', 0)}",
+        f"✅ {t.get('approved', 0)} / ❌ {t.get('rejected', 0)}",
+    ]
+    if st["approve_ratio"] is not None:
+        lines.append(f"Частка схвалених: {st['approve_ratio'] * 100:.0f}% · "
+                     f"середній час модерації: {st['avg_moderation_s'] / 60:.0f} хв")
+    if st["categories"]:
+        lines.append("")
+        for cat, by_outcome in sorted(st["categories"].items(), key=lambda kv: -kv[1].get("categorized", 0)):
+            lines.append(f"{cat}: {by_outcome.get('categorized', 0)}")
+    await update.message.reply_text("\n".join(lines))
+
 # ========= ROUTING =========
+tg_app.add_handler(TypeHandler(Update, rate_gate), group=-2)
+tg_app.add_handler(TypeHandler(Update, dedup_gate), group=-1)
+
 tg_app.add_handler(CommandHandler("start", start))
 tg_app.add_handler(CommandHandler("report", report_cmd))
 tg_app.add_handler(CommandHandler("rules", rules_cmd))
 tg_app.add_handler(CommandHandler("chatid", chatid))
+tg_app.add_handler(CommandHandler("dups", dups_cmd))
+tg_app.add_handler(CommandHandler("nearby", nearby_cmd))
+tg_app.add_handler(CommandHandler("hotspots", hotspots_cmd))
+tg_app.add_handler(CommandHandler("stats", stats_cmd))
+tg_app.add_handler(CommandHandler("search", search_cmd))
+tg_app.add_handler(CommandHandler("queue", queue_cmd))
+tg_app.add_handler(CommandHandler("vacuum", vacuum_cmd))
 
-tg_app.add_handler(CallbackQueryHandler(start_new_report, pattern=r"^newreport$"))
-tg_app.add_handler(CallbackQueryHandler(handle_category,   pattern=r"^cat\|"))
-tg_app.add_handler(CallbackQueryHandler(det_action,        pattern=r"^det\|"))
-tg_app.add_handler(CallbackQueryHandler(mod_action,        pattern=r"^mod\|"))
-tg_app.add_handler(CallbackQueryHandler(admin_recat_set,   pattern=r"^recatset\|"))
-tg_app.add_handler(CallbackQueryHandler(show_rules_btn,    pattern=r"^showrules$"))
+# callback_data "prefix|..." -> хендлер: один dict lookup замість перебору regex-ів.
+# Цілі обгорнуті таймером тут — instrument_handlers бачить лише сам роутер.
+CALLBACK_ROUTES = {prefix: metrics.timed_handler(fn) for prefix, fn in {
+    "newreport": start_new_report,
+    "adminmsg":  ask_admin_msg,
+    "showrules": show_rules_btn,
+    "cat":       handle_category,
+    "det":       det_action,
+    "mod":       mod_action,
+    "recatset":  admin_recat_set,
+    "srch":      search_page,
+    "qm":        queue_action,
+}.items()}
+
+async def route_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    handler = CALLBACK_ROUTES.get((q.data or "").split("|", 1)[0])
+    if handler is None:
+        await q.answer()   # застаріла кнопка — лише прибираємо «годинник»
+        return
+    await handler(update, context)
+
+# очікуваний крок -> хендлер тексту (отримує rec_id з кроку); порядок — пріоритет,
+# якщо користувач розпочав кілька кроків. Правка адміна — лише в чаті модераторів.
+USER_TEXT_STEPS = tuple((key, metrics.timed_handler(fn)) for key, fn in (
+    ("await_loc_rec",   handle_address_text),
+    ("await_note_rec",  handle_note_text),
+    ("await_admin_msg", handle_admin_msg_text),
+))
+ADMIN_TEXT_STEPS = (("admin_edit_rec", metrics.timed_handler(admin_text_override_inbox)),)
+menu_fallback = metrics.timed_handler(auto_menu_fallback)
+
+async def route_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message.text.strip():
+        return
+    admin = is_admin_chat(update.effective_chat.id)
+    pending = await state.load(user_scope(update.effective_user.id))
+    for key, handler in (ADMIN_TEXT_STEPS if admin else USER_TEXT_STEPS):
+        if key in pending:
+            await handler(update, context, pending[key])
+            return
+    if not admin:
+        await menu_fallback(update, context)
+
+tg_app.add_handler(CallbackQueryHandler(route_callback))
 
 # прийом медіа
 tg_app.add_handler(MessageHandler(filters.PHOTO | filters.VIDEO, handle_media))
-# прийом геолокації/тексту під час очікування
+# прийом геолокації під час очікування
 tg_app.add_handler(MessageHandler(filters.LOCATION, handle_location))
-tg_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_while_waiting))
-# прийом текстів від адміна (редагування)
-if ADMIN_CHAT_ID:
-    tg_app.add_handler(MessageHandler(
-        (filters.Chat(int(ADMIN_CHAT_ID)) & filters.TEXT & ~filters.COMMAND),
-        admin_text_override_inbox
-    ))
-# авто-меню як останній текстовий хендлер
-tg_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, auto_menu_fallback))
+# весь інший текст: крок, що очікується (адреса, коментар, правка, звернення), або авто-меню
+tg_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, route_text))
+# латентність і помилки кожного хендлера — у /metrics
+metrics.instrument_handlers(tg_app)
+
+# апдейти, які жоден хендлер не обробить, відсікаються у вебхуку ще до Update.de_json
+async def admin_edit_pending(uid: int) -> bool:
+    return "admin_edit_rec" in await state.load(user_scope(uid))
+
+ALLOWED_UPDATES = allowed_updates(tg_app)
+prefilter = Prefilter(ALLOWED_UPDATES, int(ADMIN_CHAT_ID) if ADMIN_CHAT_ID else None, admin_edit_pending)
 
 # ========= FASTAPI LIFECYCLE =========
+_T_MODULE = time.perf_counter()
+_deferred: asyncio.Task | None = None
+_deferred_timer: asyncio.TimerHandle | None = None
+
+class StartupPhases:
+    # "db 12ms, schema 1ms, ..." — куди йде час холодного старту
+    def __init__(self, *done: str):
+        self.items, self.t0 = list(done), time.perf_counter()
+        self.t = self.t0
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.items.append(f"{name} {(now - self.t) * 1000:.0f}ms")
+        self.t = now
+
+    def __str__(self):
+        return ", ".join(self.items)
+
+async def init_bot_identity() -> str:
+    # getMe — мережевий виклик на кожному пробудженні; ідентичність бота не змінюється,
+    # тож беремо її з БД, а справжній getMe робимо у відкладеній фазі
+    bot = tg_app.bot
+    row = await db.fetchone("SELECT value FROM meta WHERE key='bot_identity'") if FAST_START else None
+    cached = json.loads(row[0]) if row else None
+    if cached and str(cached.get("id")) == BOT_TOKEN.split(":", 1)[0]:
+        await asyncio.gather(bot._request[0].initialize(), bot._request[1].initialize())
+        bot._bot_user = User.de_json(cached, bot)
+        bot._initialized = True
+        await tg_app.initialize()
+        return "cache"
+    await tg_app.initialize()
+    await save_bot_identity()
+    return "getMe"
+
+async def save_bot_identity():
+    await db.execute(
+        "INSERT INTO meta(key, value) VALUES('bot_identity', ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        (json.dumps(tg_app.bot.bot.to_dict()),)
+    )
+
+async def deferred_startup():
+    # не потрібне для відповіді на перший апдейт
+    phases = StartupPhases()
+    try:
+        await state.start()
+        await dedup.purge()
+        phases.mark("state")
+        outbox.start()
+        phases.mark("outbox")
+        if RETENTION_INTERVAL > 0:
+            retention.start()
+        if FAST_START:
+            await tg_app.bot.get_me()
+            await save_bot_identity()
+            phases.mark("getMe")
+        if WEBHOOK_URL:
+            await tg_app.bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}/webhook/{WEBHOOK_SECRET}",
+                                         allowed_updates=ALLOWED_UPDATES)
+            phases.mark("setWebhook")
+    except Exception as e:
+        print("DEFERRED STARTUP ERROR:", e)
+    print("STARTUP deferred:", phases)
+
+def run_deferred_startup():
+    global _deferred
+    if _deferred is None:
+        if _deferred_timer is not None:
+            _deferred_timer.cancel()
+        _deferred = asyncio.create_task(deferred_startup())
+
 @app.on_event("startup")
 async def on_startup():
-    await init_db()
-    await tg_app.initialize()
+    global _deferred_timer
+    phases = StartupPhases(f"import {(_T_MODULE - _T_IMPORT) * 1000:.0f}ms")
+    await db.open()
+    phases.mark("db")
+    await init_db()   # при актуальній схемі — лише PRAGMA user_version
+    phases.mark("schema")
+    users.start()
+    drafts.start()
+    source = await init_bot_identity()
+    phases.mark(f"bot({source})")
     await tg_app.start()
+    if ingest:
+        ingest.start()
+    phases.mark("ptb")
+    if FAST_START:
+        # решта — після першого апдейту або через STARTUP_DEFER_S, що настане раніше
+        _deferred_timer = asyncio.get_running_loop().call_later(STARTUP_DEFER_S, run_deferred_startup)
+    else:
+        await deferred_startup()
+    print(f"STARTUP ready in {(time.perf_counter() - phases.t0) * 1000:.0f}ms:", phases)
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    if _deferred_timer is not None:
+        _deferred_timer.cancel()
+    if _deferred is not None:
+        await asyncio.gather(_deferred, return_exceptions=True)
+    if ingest:
+        await ingest.stop()
+    await albums.stop()
+    await outbox.stop()
+    await retention.stop()
     await tg_app.stop()
     await tg_app.shutdown()
+    await drafts.stop()
+    await users.stop()
+    await state.stop()
+    await dedup.stop()
+    await db.close()
 
 # Пінг від cron-джоба — щоб пробудити інстанс
 @app.get("/")
@@ -571,12 +1450,190 @@ async def root():
     print("✅ PING from CRON received — Render instance is awake.")
     return {"ok": True, "ping": "received"}
 
+def check_api_token(request: Request):
+    # лише заголовок (query-рядок осідає в логах доступу); без API_TOKEN службові ендпоінти вимкнені
+    if not API_TOKEN:
+        raise HTTPException(status_code=404)
+    token = request.headers.get("X-Api-Token", "")
+    if not hmac.compare_digest(token.encode(), API_TOKEN.encode()):
+        raise HTTPException(status_code=403)
+
+# Стан черги вхідних апдейтів (глибина, час очікування)
+@app.get("/ingest")
+async def ingest_stats(request: Request):
+    check_api_token(request)
+    if not ingest:
+        return {"mode": INGEST_MODE}
+    return {"mode": INGEST_MODE, **ingest.stats()}
+
+# Зведена статистика з rollup-таблиці
+@app.get("/stats")
+async def stats_json(request: Request, days: int = 7):
+    check_api_token(request)
+    return await read_stats(min(max(days, 1), 3650))
+
+# Prometheus: гістограми хендлерів, SQLite, Bot API, вебхука + поточні gauges
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    check_api_token(request)
+    gauges = {
+        "bot_outbox_pending": await outbox.pending(),
+        "bot_user_cache_size": len(users._rows),
+        "bot_user_cache_hits_total": users.hits,
+        "bot_user_cache_misses_total": users.misses,
+        "bot_draft_cache_size": len(drafts._drafts),
+        "bot_draft_cache_hits_total": drafts.hits,
+        "bot_draft_cache_misses_total": drafts.misses,
+        "bot_rate_limited_total": limiter.dropped,
+        "bot_retention_archived_total": retention.archived,
+        "bot_retention_purged_total": retention.purged,
+        "bot_retention_vacuumed_pages_total": retention.vacuumed_pages,
+    }
+    if ingest:
+        st = ingest.stats()
+        gauges["bot_ingest_queue_depth"] = st["depth"]
+        gauges["bot_ingest_rejected_total"] = st["rejected"]
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
+# ===== Експорт для активістів і поліції: CSV / GeoJSON потоком =====
+EXPORT_PAGE = 500
+EXPORT_FIELDS = ("id", "time", "status", "category", "pdr", "lat", "lon", "address", "note")
+
+def _day_ts(day: str | None, default: int) -> int:
+    # "2025-06-01" -> початок доби (UTC)
+    if not day:
+        return default
+    try:
+        return calendar.timegm(time.strptime(day, "%Y-%m-%d"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"bad date: {day}")
+
+async def export_rows(since: int, until: int, category: str | None, statuses: list[str]):
+    # keyset по id: кожна сторінка — окремий короткий SELECT, між ними вебхуки обслуговуються далі;
+    # у памʼяті не більше однієї сторінки
+    # межі id — крайні рядки періоду з idx_inbox_ts (по одному пошуку в індексі, без
+    # сканування діапазону), щоб жодна сторінка не читала рядки поза періодом
+    lo, hi = await db.fetchone(
+        "SELECT (SELECT id FROM inbox WHERE ts>=? ORDER BY ts, id LIMIT 1), "
+        "(SELECT id FROM inbox WHERE ts<? ORDER BY ts DESC, id DESC LIMIT 1)", (since, until)
+    )
+    if lo is None or hi is None:
+        return
+    cat = GEO_CATEGORY_SQL.format(r="inbox")
+    where = f"id>? AND id<=? AND ts>=? AND ts<? AND status IN ({','.join('?' * len(statuses))})"
+    params = [hi, since, until, *statuses]
+    if category:
+        where += f" AND {cat}=?"
+        params.append(category)
+    last = lo - 1
+    while True:
+        rows = await db.fetchall(
+            f"SELECT id, ts, status, {cat}, location_lat, location_lon, location_text, user_note "
+            f"FROM inbox WHERE {where} ORDER BY id LIMIT ?", (last, *params, EXPORT_PAGE)
+        )
+        for rid, ts, status, category_name, lat, lon, address, note in rows:
+            yield {
+                "id": rid,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(ts or 0)),
+                "status": status,
+                "category": category_name,
+                "pdr": PDR_MAP.get(category_name, ""),
+                "lat": lat,
+                "lon": lon,
+                "address": address or "",
+                "note": note or "",
+            }
+        if len(rows) < EXPORT_PAGE:
+            return
+        last = rows[-1][0]
+
+async def export_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_FIELDS)
+    yield "\ufeff" + buf.getvalue()   # BOM — щоб Excel відкрив кирилицю
+    async for r in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow([r[f] if r[f] is not None else "" for f in EXPORT_FIELDS])
+        yield buf.getvalue()
+
+async def export_geojson(rows):
+    yield '{"type":"FeatureCollection","features":['
+    sep = ""
+    async for r in rows:
+        lat, lon = r.pop("lat"), r.pop("lon")
+        geometry = {"type": "Point", "coordinates": [lon, lat]} if lat is not None and lon is not None else None
+        yield sep + json.dumps({"type": "Feature", "id": r["id"], "geometry": geometry, "properties": r},
+                               ensure_ascii=False)
+        sep = ","
+    yield "]}"
+
+# GET /export?format=csv|geojson&since=YYYY-MM-DD&until=YYYY-MM-DD&category=c1&status=published,approved
+@app.get("/export")
+async def export_endpoint(request: Request, format: str = "csv", since: str | None = None, until: str | None = None,
+                          category: str | None = None, status: str = "published"):
+    check_api_token(request)
+    if format not in ("csv", "geojson"):
+        raise HTTPException(status_code=400, detail="format: csv | geojson")
+    if category is not None:
+        category = CATEGORY_MAP.get(category, category)
+    statuses = [s.strip() for s in status.split(",") if s.strip()]
+    if not statuses:
+        raise HTTPException(status_code=400, detail="status")
+    # until — включно: до кінця вказаної доби
+    rows = export_rows(_day_ts(since, 0), _day_ts(until, 2**31 - 86400) + 86400, category, statuses)
+    stamp = time.strftime("%Y%m%d")
+    if format == "csv":
+        body, media, ext = export_csv(rows), "text/csv; charset=utf-8", "csv"
+    else:
+        body, media, ext = export_geojson(rows), "application/geo+json", "geojson"
+    return StreamingResponse(body, media_type=media,
+                             headers={"Content-Disposition": f'attachment; filename="reports-{stamp}.{ext}"'})
+
 # ========= WEBHOOK =========
 @app.post(f"/webhook/{{secret}}")
 async def telegram_webhook(secret: str, request: Request):
+    t0, failed = time.perf_counter(), False
+    try:
+        return await _handle_webhook(secret, request)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        metrics.record(metrics.WEBHOOK_SECONDS, metrics.WEBHOOK_ERRORS, "webhook", "", t0, failed)
+        run_deferred_startup()   # перший апдейт обслужено — можна доініціалізуватись
+
+async def _handle_webhook(secret: str, request: Request):
     if secret != WEBHOOK_SECRET:
         raise HTTPException(status_code=403)
-    data = await request.json()
-    update = Update.de_json(data, tg_app.bot)
-    await tg_app.process_update(update)
-    return {"ok": True}
+    try:
+        data = json_loads(await request.body())
+    except Exception:
+        raise HTTPException(status_code=400)
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400)
+    skip = await prefilter.skip_reason(data)
+    if skip:
+        # 200, щоб Telegram не повторював доставку
+        metrics.WEBHOOK_SKIPPED.inc(skip)
+        return {"ok": True}
+    try:
+        update = Update.de_json(data, tg_app.bot)
+    except Exception:
+        raise HTTPException(status_code=400)
+    if update is None:
+        raise HTTPException(status_code=400)
+    # повтори того самого апдейту відсіює dedup_gate — після лімітера, всередині обробки
+    if ingest:
+        # апдейти одного користувача — в один воркер, щоб зберегти порядок
+        user = update.effective_user
+        key = user.id if user else (update.effective_chat.id if update.effective_chat else update.update_id)
+        if not ingest.submit(key, update):
+            # черга повна — Telegram повторить доставку пізніше (апдейт ще не застовпчено)
+            return Response(status_code=503, headers={"Retry-After": "1"})
+        return {"ok": True}
+    # WEBHOOK_REPLY: перший придатний виклик Bot API стає тілом відповіді — на один HTTPS-запит менше.
+    with webhookreply.capture() if WEBHOOK_REPLY else nullcontext() as reply:
+        await tg_app.process_update(update)
+    return (reply and reply.payload) or {"ok": True}
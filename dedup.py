@@ -0,0 +1,84 @@
+import asyncio, time
+from collections import OrderedDict
+
+# ========= ДЕДУПЛІКАЦІЯ АПДЕЙТІВ =========
+# Коли вебхук відповідає повільно, Telegram доставляє той самий update_id ще раз.
+# Недавні id тримаємо в памʼяті (обмежений LRU), а таблиця seen_updates переживає
+# рестарт і спільна для всіх воркерів. Запис у неї — пакетом раз на flush_delay
+# (як SQLiteStateStore), а не окремою транзакцією під локом запису на кожен апдейт.
+# Повтор приходить лише після таймауту відповіді — до того батч уже в БД, тож
+# інший воркер чи процес після рестарту знайде id одним читанням без локу.
+class UpdateDedup:
+    def __init__(self, db, maxsize: int = 10000, ttl: int = 86400, purge_every: int = 1000,
+                 flush_delay: float = 0.5):
+        self.db = db
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl                  # Telegram тримає недоставлені апдейти не довше доби
+        self.purge_every = purge_every
+        self.flush_delay = flush_delay
+        self._seen: OrderedDict[int, None] = OrderedDict()
+        self._pending: list[tuple[int, int]] = []   # (update_id, ts), ще не записані
+        self._flusher: asyncio.Task | None = None
+        self._unpurged = 0
+        self.claimed = 0
+        self.duplicates = 0
+
+    def _remember(self, update_id: int):
+        self._seen[update_id] = None
+        while len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
+
+    async def claim(self, update_id: int) -> bool:
+        # True — апдейт новий і його треба обробити; False — повтор
+        if update_id in self._seen:
+            self.duplicates += 1
+            return False
+        # у памʼять до await: паралельний повтор того ж апдейту побачить його одразу
+        self._remember(update_id)
+        try:
+            row = await self.db.fetchone("SELECT 1 FROM seen_updates WHERE update_id=?", (update_id,))
+        except BaseException:
+            # не перевірили (напр. "database is locked") — повтор від Telegram має пройти
+            self._seen.pop(update_id, None)
+            raise
+        if row is not None:
+            self.duplicates += 1
+            return False
+        self._pending.append((update_id, int(time.time())))
+        self._schedule()
+        self.claimed += 1
+        return True
+
+    def _schedule(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, []
+        try:
+            await self.db.executemany("INSERT OR IGNORE INTO seen_updates(update_id, ts) VALUES(?,?)", batch)
+        except Exception as e:
+            self._pending[:0] = batch
+            print("DEDUP FLUSH ERROR:", e)
+            return 0
+        self._unpurged += len(batch)
+        if self._unpurged >= self.purge_every:
+            self._unpurged = 0
+            await self.purge()
+        return len(batch)
+
+    async def purge(self):
+        await self.db.execute("DELETE FROM seen_updates WHERE ts<?", (int(time.time()) - self.ttl,))
+
+    async def stop(self):
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,155 @@
+import asyncio, time
+from collections import OrderedDict
+
+# ========= ЧЕРНЕТКИ РЕПОРТІВ =========
+# Поки користувач проходить майстер (категорія → локація/коментар → «Далі»), репорт
+# живе в памʼяті: кнопки майстра не читають inbox, а правки лише змінюють чернетку.
+# У БД вона потрапляє в контрольних точках — разом із передачею на публікацію чи
+# модерацію, при витісненні за TTL і на shutdown. Промах (рестарт, інший воркер) —
+# один SELECT. Кешуємо лише рядки зі status='draft': уже переданий репорт лише читаємо,
+# а його правки пишемо одразу. Кліки майстра можуть потрапити в будь-який воркер чи
+# інстанс, а правки в памʼяті бачить лише один процес — тому кеш вмикається явно
+# (DRAFT_TTL>0) і лише для одного процесу; за замовчуванням ttl=0 — кожна правка в БД.
+class Draft:
+    __slots__ = ("rec_id", "values", "dirty", "touched")
+
+    def __init__(self, rec_id: int, values: dict):
+        self.rec_id = rec_id
+        self.values = values
+        self.dirty: set[str] = set()
+        self.touched = time.monotonic()
+
+    def row(self, columns) -> tuple:
+        # той самий порядок, що й у get_inbox_rec
+        return tuple(self.values.get(c) for c in columns)
+
+class DraftStore:
+    def __init__(self, db, columns: tuple, ttl: float = 0, maxsize: int = 10000):
+        self.db = db
+        self.columns = columns          # колонки inbox у порядку рядка get_inbox_rec
+        self.ttl = ttl
+        self.maxsize = max(1, maxsize)
+        self._drafts: OrderedDict[int, Draft] = OrderedDict()
+        self._last: dict[int, int] = {}  # user_id -> rec_id останньої чернетки
+        self._task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def put(self, rec_id: int, **values):
+        # щойно вставлений рядок: усе відомо без читання БД
+        if not self.enabled:
+            return
+        self._add(Draft(rec_id, {c: values.get(c) for c in self.columns}))
+        self._last[values["user_id"]] = rec_id
+
+    def _add(self, d: Draft):
+        self._drafts[d.rec_id] = d
+        while len(self._drafts) > self.maxsize:
+            old = next(iter(self._drafts.values()))
+            self.drop(old.rec_id)
+            if old.dirty:
+                asyncio.create_task(self._write(old))
+
+    def last_for(self, uid: int) -> Draft | None:
+        # остання чернетка користувача, якщо вона ще в памʼяті
+        d = self._drafts.get(self._last.get(uid))
+        return d if d is not None and d.values["user_id"] == uid else None
+
+    async def get(self, rec_id: int) -> Draft | None:
+        d = self._drafts.get(rec_id)
+        if d is not None:
+            self.hits += 1
+            d.touched = time.monotonic()
+            self._drafts.move_to_end(rec_id)
+            return d
+        self.misses += 1
+        r = await self.db.fetchone(f"SELECT status, {', '.join(self.columns)} FROM inbox WHERE id=?", (rec_id,))
+        if r is None:
+            return None
+        # інший корутин міг уже завантажити (і змінити) цю чернетку, поки ми чекали БД
+        d = self._drafts.get(rec_id)
+        if d is None:
+            d = Draft(rec_id, dict(zip(self.columns, r[1:])))
+            if self.enabled and r[0] == "draft":
+                self._add(d)
+        return d
+
+    async def update(self, rec_id: int, **fields) -> Draft | None:
+        d = await self.get(rec_id)
+        if d is None:
+            return None
+        d.values.update(fields)
+        d.dirty.update(fields)
+        if self._drafts.get(rec_id) is not d:
+            # не в кеші (ttl=0 чи репорт уже передано) — пишемо одразу
+            await self._write(d)
+        return d
+
+    def mark_saved(self, rec_id: int, **fields):
+        # поле вже записане викликачем (напр. category разом зі статистикою)
+        d = self._drafts.get(rec_id)
+        if d is not None:
+            d.values.update(fields)
+            d.dirty.difference_update(fields)
+
+    async def save(self, conn, d: Draft):
+        # контрольна точка в транзакції викликача; dirty не чистимо — якщо транзакцію
+        # відкотять, чернетка лишиться в памʼяті з усіма правками (викликач робить drop)
+        if not d.dirty:
+            return
+        fields = sorted(d.dirty)
+        await conn.execute(
+            f"UPDATE inbox SET {', '.join(f + '=?' for f in fields)} WHERE id=?",
+            (*(d.values[f] for f in fields), d.rec_id)
+        )
+
+    async def _write(self, d: Draft):
+        written = set(d.dirty)
+        try:
+            async with self.db.tx() as conn:
+                await self.save(conn, d)
+        except Exception as e:
+            print("DRAFT SAVE ERROR:", d.rec_id, e)
+            return
+        d.dirty -= written
+
+    def drop(self, rec_id: int):
+        # чернетку передано далі (публікація / модерація) — її вже записано
+        d = self._drafts.pop(rec_id, None)
+        if d is not None and self._last.get(d.values["user_id"]) == rec_id:
+            del self._last[d.values["user_id"]]
+
+    async def evict(self, rec_id: int):
+        d = self._drafts.get(rec_id)
+        if d is None:
+            return
+        self.drop(rec_id)
+        await self._write(d)
+
+    async def sweep(self) -> int:
+        cutoff = time.monotonic() - self.ttl
+        stale = [rid for rid, d in self._drafts.items() if d.touched < cutoff]
+        for rid in stale:
+            await self.evict(rid)
+        return len(stale)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(min(self.ttl, 60))
+            await self.sweep()
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for rid in list(self._drafts):
+            await self.evict(rid)
@@ -0,0 +1,82 @@
+import asyncio, time
+
+# ========= ЧЕРГА ВХІДНИХ АПДЕЙТІВ =========
+# webhook лише кладе апдейт у чергу й одразу відповідає 200.
+# Черга шардована за ключем (user_id): апдейти одного користувача йдуть строго по черзі
+# в одному воркері, різні користувачі — паралельно в різних воркерах.
+class IngestQueue:
+    def __init__(self, handler, workers: int = 4, maxsize: int = 1000):
+        self.handler = handler
+        workers = max(1, workers)
+        self.queues = [asyncio.Queue(maxsize=max(1, maxsize // workers)) for _ in range(workers)]
+        self.tasks: list[asyncio.Task] = []
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_last = 0.0
+        self.wait_max = 0.0
+        self.wait_sum = 0.0
+
+    def submit(self, key, item) -> bool:
+        # False = черга переповнена, відправник має повторити пізніше
+        q = self.queues[hash(key) % len(self.queues)]
+        try:
+            q.put_nowait((time.monotonic(), item))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    async def _worker(self, q: asyncio.Queue):
+        while True:
+            enq_ts, item = await q.get()
+            wait = time.monotonic() - enq_ts
+            self.wait_last = wait
+            self.wait_sum += wait
+            if wait > self.wait_max:
+                self.wait_max = wait
+            try:
+                await self.handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                print("INGEST ERROR:", e)
+            finally:
+                q.task_done()
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._worker(q)) for q in self.queues]
+
+    async def stop(self, timeout: float = 10.0):
+        # даємо дообробити те, що вже прийняли, потім гасимо воркери
+        if not self.tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            print("INGEST: shutdown timeout, dropping", self.depth(), "updates")
+        for t in self.tasks:
+            t.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def stats(self) -> dict:
+        done = self.processed + self.failed
+        return {
+            "workers": len(self.queues),
+            "depth": self.depth(),
+            "capacity": sum(q.maxsize for q in self.queues),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_last_ms": round(self.wait_last * 1000, 2),
+            "wait_avg_ms": round(self.wait_sum / done * 1000, 2) if done else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
@@ -0,0 +1,142 @@
+import functools, os, time
+from telegram.ext import ApplicationHandlerStop
+from telegram.request import HTTPXRequest
+
+# ========= МЕТРИКИ =========
+# Мінімальні гістограми/лічильники у форматі Prometheus (без зовнішніх залежностей).
+# Все в памʼяті процесу; при кількох воркерах кожен віддає свої значення.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_CALL_MS = float(os.environ.get("SLOW_CALL_MS", "0"))   # >0 — логувати виклики, довші за поріг
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label: str | None = None):
+        self.name, self.help, self.label = name, help_text, label
+        self._series: dict[str, list] = {}   # значення мітки -> [лічильники бакетів..., +Inf, сума]
+
+    def observe(self, seconds: float, label_value: str = ""):
+        s = self._series.get(label_value)
+        if s is None:
+            s = self._series[label_value] = [0] * (len(BUCKETS) + 1) + [0.0]
+        for i, b in enumerate(BUCKETS):
+            if seconds <= b:
+                s[i] += 1
+        s[len(BUCKETS)] += 1
+        s[-1] += seconds
+
+    def _labels(self, value: str, extra: str = "") -> str:
+        parts = [f'{self.label}="{_escape(value)}"'] if self.label else []
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, s in sorted(self._series.items()):
+            for i, b in enumerate(BUCKETS):
+                le = self._labels(value, 'le="%s"' % b)
+                out.append(f"{self.name}_bucket{le} {s[i]}")
+            le = self._labels(value, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{le} {s[len(BUCKETS)]}")
+            out.append(f"{self.name}_sum{self._labels(value)} {s[-1]:.6f}")
+            out.append(f"{self.name}_count{self._labels(value)} {s[len(BUCKETS)]}")
+        return out
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label: str | None = None):
+        self.name, self.help, self.label = name, help_text, label
+        self._values: dict[str, float] = {}
+
+    def inc(self, label_value: str = "", n: float = 1):
+        self._values[label_value] = self._values.get(label_value, 0) + n
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for value, v in sorted(self._values.items()):
+            labels = f'{{{self.label}="{_escape(value)}"}}' if self.label else ""
+            out.append(f"{self.name}{labels} {v:g}")
+        return out
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Handler latency", "handler")
+HANDLER_ERRORS  = Counter("bot_handler_errors_total", "Handler exceptions", "handler")
+DB_SECONDS      = Histogram("bot_db_seconds", "SQLite statement/transaction latency", "query")
+DB_ERRORS       = Counter("bot_db_errors_total", "SQLite errors", "query")
+DB_LOCK_WAIT    = Histogram("bot_db_lock_wait_seconds", "Wait for the shared write transaction lock")
+API_SECONDS     = Histogram("bot_api_seconds", "Telegram Bot API call latency", "method")
+API_ERRORS      = Counter("bot_api_errors_total", "Telegram Bot API call errors", "method")
+API_INLINE      = Counter("bot_api_inline_total", "Bot API calls returned in the webhook response", "method")
+WEBHOOK_SECONDS = Histogram("bot_webhook_seconds", "Webhook request end-to-end latency")
+WEBHOOK_ERRORS  = Counter("bot_webhook_errors_total", "Webhook requests that raised")
+WEBHOOK_SKIPPED = Counter("bot_webhook_skipped_total", "Updates acknowledged without dispatch", "reason")
+
+ALL = [HANDLER_SECONDS, HANDLER_ERRORS, DB_SECONDS, DB_ERRORS, DB_LOCK_WAIT,
+       API_SECONDS, API_ERRORS, API_INLINE, WEBHOOK_SECONDS, WEBHOOK_ERRORS, WEBHOOK_SKIPPED]
+
+def record(hist: Histogram, errors: Counter | None, kind: str, name: str, started: float, failed: bool):
+    elapsed = time.perf_counter() - started
+    hist.observe(elapsed, name)
+    if failed and errors is not None:
+        errors.inc(name)
+    if SLOW_CALL_MS and elapsed * 1000 >= SLOW_CALL_MS:
+        print(f"SLOW {kind} {name}: {elapsed * 1000:.1f} ms{' (error)' if failed else ''}")
+
+# ---- хендлери PTB
+def timed_handler(callback):
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context, *args):
+        t0, failed = time.perf_counter(), False
+        try:
+            return await callback(update, context, *args)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            record(HANDLER_SECONDS, HANDLER_ERRORS, "handler", name, t0, failed)
+    return wrapper
+
+def instrument_handlers(application):
+    for handlers in application.handlers.values():
+        for h in handlers:
+            if not getattr(h.callback, "__wrapped__", None):
+                h.callback = timed_handler(h.callback)
+
+# ---- SQLite (підключається як Storage.observe)
+def db_observer(label: str, started: float, failed: bool):
+    record(DB_SECONDS, DB_ERRORS, "db", label, started, failed)
+
+def db_lock_observer(waited: float):
+    DB_LOCK_WAIT.observe(waited)
+
+# ---- Bot API: кожен HTTP-виклик до api.telegram.org
+class InstrumentedRequest(HTTPXRequest):
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        t0, failed = time.perf_counter(), False
+        try:
+            code, payload = await super().do_request(
+                url, method, request_data=request_data, read_timeout=read_timeout,
+                write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+            )
+            failed = code >= 400
+            return code, payload
+        except Exception:
+            failed = True
+            raise
+        finally:
+            record(API_SECONDS, API_ERRORS, "api", api_method, t0, failed)
+
+def render(extra_gauges: dict | None = None) -> str:
+    lines = []
+    for m in ALL:
+        lines += m.render()
+    for name, value in (extra_gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
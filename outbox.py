@@ -0,0 +1,217 @@
+import asyncio, json, os, time, uuid
+from telegram import InlineKeyboardMarkup, InputMediaPhoto, InputMediaVideo
+from telegram.error import RetryAfter, BadRequest, Forbidden, TelegramError
+
+# ========= OUTBOX =========
+# Вихідні пости (канал, модерація) спершу пишуться в таблицю outbox, а фоновий
+# відправник шле їх з обмеженням швидкості по кожному чату та глобально.
+# Рядки переживають рестарт: незавершені відправляються після старту.
+MAX_ATTEMPTS = 8
+IDLE_WAIT    = 60.0   # скільки спимо без нових записів (enqueue будить раніше)
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate          # токенів за секунду
+        self.capacity = burst
+        self.tokens = burst
+        self.ts = time.monotonic()
+        self.paused_until = 0.0   # RetryAfter від Telegram
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+        self.ts = now
+
+    def delay(self, now: float) -> float:
+        # через скільки секунд буде доступний токен (0 — вже)
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+class Lease:
+    # лише один процес (з кількох воркерів uvicorn) веде відправку: ліміти Telegram
+    # спільні на весь бот, а порядок постів у чаті має зберігатись
+    def __init__(self, db, name: str, ttl: int = 30):
+        self.db = db
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    async def acquire(self) -> bool:
+        now = int(time.time())
+        cur = await self.db.execute(
+            "INSERT INTO leases(name, owner, expires) VALUES(?,?,?) "
+            "ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires=excluded.expires "
+            "WHERE leases.owner=excluded.owner OR leases.expires<?",
+            (self.name, self.owner, now + self.ttl, now)
+        )
+        return cur.rowcount > 0
+
+    async def release(self):
+        await self.db.execute("DELETE FROM leases WHERE name=? AND owner=?", (self.name, self.owner))
+
+def _chat(v: str):
+    v = (v or "").strip()
+    return int(v) if v.lstrip("-").isdigit() else v
+
+class Outbox:
+    def __init__(self, db, bot, chat_per_min: float = 20, global_per_s: float = 30, batch: int = 50,
+                 lease=None, on_sent=None):
+        self.db = db
+        self.bot = bot
+        self.lease = lease
+        self.on_sent = on_sent   # async fn(conn, ref) — в тій самій транзакції, що й видалення рядка
+        self.chat_rate = chat_per_min / 60.0
+        self.batch = batch
+        self.glob = TokenBucket(global_per_s, global_per_s)
+        self.buckets: dict[str, TokenBucket] = {}
+        self._wake = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.sent = 0
+        self.failed = 0
+
+    async def enqueue(self, chat_id, method: str, conn=None, ref=None, **kwargs) -> int:
+        # conn — транзакція викликача (пост і зміна стану репорту комітяться разом);
+        # ref — id репорту, про відправку якого треба повідомити on_sent
+        kb = kwargs.get("reply_markup")
+        if kb is not None and hasattr(kb, "to_dict"):
+            kwargs["reply_markup"] = kb.to_dict()
+        sql = "INSERT INTO outbox(chat_id, method, payload, created, next_try, ref) VALUES(?,?,?,?,?,?)"
+        params = (str(chat_id), method, json.dumps(kwargs, ensure_ascii=False), int(time.time()), 0, ref)
+        if conn is not None:
+            # будимо відправника лише після коміту транзакції викликача
+            cur = await conn.execute(sql, params)
+            self.db.after_commit(self._wake.set)
+        else:
+            cur = await self.db.execute(sql, params)
+            self._wake.set()
+        return cur.lastrowid
+
+    def _bucket(self, chat: str) -> TokenBucket:
+        b = self.buckets.get(chat)
+        if b is None:
+            # невеликий burst, щоб не впертись у ліміт групи/каналу одразу
+            b = self.buckets[chat] = TokenBucket(self.chat_rate, 3)
+        return b
+
+    async def _send(self, chat: str, method: str, payload: dict):
+        if "reply_markup" in payload:
+            payload["reply_markup"] = InlineKeyboardMarkup.de_json(payload["reply_markup"], self.bot)
+        if "media" in payload:
+            payload["media"] = [
+                (InputMediaPhoto if m["type"] == "photo" else InputMediaVideo)(media=m["media"], caption=m.get("caption"))
+                for m in payload["media"]
+            ]
+        return await getattr(self.bot, method)(chat_id=_chat(chat), **payload)
+
+    async def _pump(self) -> float:
+        # відправляє все, що дозволяють ліміти; повертає, скільки чекати до наступного проходу
+        now = time.time()
+        # committed: рядок, доданий у ще відкриту транзакцію, можуть відкотити
+        rows = await self.db.fetchall(
+            "SELECT id, chat_id, method, payload, attempts, ref FROM outbox "
+            "WHERE status='pending' AND next_try<=? ORDER BY id LIMIT ?", (int(now), self.batch), committed=True
+        )
+        next_in = IDLE_WAIT
+        blocked = set()   # чат, у якого попередній пост ще не пішов — наступні теж чекають (порядок)
+        for rec_id, chat, method, payload, attempts, ref in rows:
+            if chat in blocked:
+                continue
+            mono = time.monotonic()
+            bucket = self._bucket(chat)
+            wait = max(bucket.delay(mono), self.glob.delay(mono))
+            if wait > 0:
+                blocked.add(chat)
+                next_in = min(next_in, wait)
+                continue
+            bucket.take(mono)
+            self.glob.take(mono)
+            try:
+                await self._send(chat, method, json.loads(payload))
+            except RetryAfter as e:
+                ra = e.retry_after
+                ra = ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra)
+                bucket.pause(time.monotonic(), ra)
+                blocked.add(chat)
+                await self.db.execute("UPDATE outbox SET next_try=? WHERE id=?", (int(time.time() + ra), rec_id))
+                next_in = min(next_in, ra)
+                continue
+            except (BadRequest, Forbidden) as e:
+                # повтор не допоможе (невірний file_id, бота прибрали з каналу тощо)
+                await self._fail(rec_id, e)
+                continue
+            except TelegramError as e:
+                attempts += 1
+                if attempts >= MAX_ATTEMPTS:
+                    await self._fail(rec_id, e)
+                    continue
+                backoff = min(2 ** attempts, 300)
+                bucket.pause(time.monotonic(), backoff)
+                blocked.add(chat)
+                await self.db.execute(
+                    "UPDATE outbox SET attempts=?, next_try=?, last_error=? WHERE id=?",
+                    (attempts, int(time.time() + backoff), str(e), rec_id)
+                )
+                next_in = min(next_in, backoff)
+                continue
+            except Exception as e:
+                await self._fail(rec_id, e)
+                continue
+            async with self.db.tx() as conn:
+                await conn.execute("DELETE FROM outbox WHERE id=?", (rec_id,))
+                if ref is not None and self.on_sent:
+                    await self.on_sent(conn, ref)
+            self.sent += 1
+        if len(rows) == self.batch and not blocked:
+            return 0.0
+        row = await self.db.fetchone("SELECT MIN(next_try) FROM outbox WHERE status='pending' AND next_try>?", (int(now),))
+        if row and row[0]:
+            next_in = min(next_in, max(row[0] - time.time(), 0.0))
+        return next_in
+
+    async def _fail(self, rec_id: int, e: Exception):
+        self.failed += 1
+        print("OUTBOX FAILED:", rec_id, e)
+        await self.db.execute("UPDATE outbox SET status='failed', last_error=? WHERE id=?", (str(e), rec_id))
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                if self.lease and not await self.lease.acquire():
+                    # відправляє інший процес; перевіряємо, чи він ще живий
+                    await asyncio.sleep(self.lease.ttl / 2)
+                    continue
+                wait = await self._pump()
+                if self.lease:
+                    wait = min(wait, self.lease.ttl / 2)
+            except Exception as e:
+                print("OUTBOX ERROR:", e)
+                wait = 5.0
+            if wait <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            if self.lease:
+                await self.lease.release()
+
+    async def pending(self) -> int:
+        return (await self.db.fetchone("SELECT COUNT(*) FROM outbox WHERE status='pending'"))[0]
@@ -0,0 +1,66 @@
+import json
+from telegram import Update
+from telegram.ext import CallbackQueryHandler, CommandHandler, ConversationHandler, MessageHandler
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:   # без orjson — стандартний json, лише повільніше
+    loads = json.loads
+
+# ========= ПРЕФІЛЬТР ВЕБХУКА =========
+# Сирий JSON апдейту класифікується ще до Update.de_json: типи й вміст, які жоден
+# хендлер не обробляє, підтверджуються 200 без побудови обʼєктів PTB і диспетчеризації.
+
+# хендлери працюють з update.message / update.callback_query, тож edited_* і channel_post
+# для них — лише помилки на None, навіть коли фільтр тексту формально їх пропускає
+HANDLER_UPDATE_TYPES = (
+    (CallbackQueryHandler, (Update.CALLBACK_QUERY,)),
+    (CommandHandler, (Update.MESSAGE,)),
+    (MessageHandler, (Update.MESSAGE,)),
+)
+# вміст повідомлень, на який є хендлери (решта — стікери, документи, сервісні)
+MESSAGE_CONTENT = ("text", "photo", "video", "location")
+
+def _handler_types(h) -> set:
+    if isinstance(h, ConversationHandler):
+        subs = list(h.entry_points) + [s for states in h.states.values() for s in states] + list(h.fallbacks)
+        return {t for s in subs for t in _handler_types(s)}
+    for cls, types in HANDLER_UPDATE_TYPES:
+        if isinstance(h, cls):
+            return set(types)
+    return set()   # TypeHandler(Update, ...) тощо — службові, власних типів не потребують
+
+def allowed_updates(application) -> list[str]:
+    # для setWebhook: Telegram не надсилатиме типи, яких ніхто не слухає
+    types = set()
+    for handlers in application.handlers.values():
+        for h in handlers:
+            types |= _handler_types(h)
+    return sorted(types)
+
+class Prefilter:
+    def __init__(self, allowed=(), admin_chat_id: int | None = None, admin_edit_pending=None):
+        self.allowed = set(allowed)
+        self.admin_chat_id = admin_chat_id
+        self.admin_edit_pending = admin_edit_pending   # async fn(uid) -> bool
+
+    async def skip_reason(self, data: dict) -> str | None:
+        # None — апдейт іде в обробку; інакше — причина (мітка метрики)
+        kind = next((k for k in data if k != "update_id"), None)
+        if kind not in self.allowed:
+            return f"type:{kind}"
+        if kind != Update.MESSAGE:
+            return None
+        msg = data[kind]
+        if not any(k in msg for k in MESSAGE_CONTENT):
+            return "content"
+        chat = msg.get("chat") or {}
+        if chat.get("type") == "private" or (msg.get("text") or "").startswith("/"):
+            return None
+        # у групах лише команди (/chatid тощо); у чаті модераторів ще й текст правки
+        if chat.get("id") == self.admin_chat_id and "text" in msg and self.admin_edit_pending:
+            uid = (msg.get("from") or {}).get("id")
+            if uid is not None and await self.admin_edit_pending(uid):
+                return None
+        return "group"
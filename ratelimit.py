@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict, deque
+
+# ========= ЛІМІТЕР =========
+# Ковзне вікно на користувача й тип дії (media / text / callback), повністю в памʼяті:
+# апдейт понад ліміт відкидається ще до хендлерів, без БД і без зайвих викликів API.
+OK, WARN, DROP = "ok", "warn", "drop"
+
+def parse_limits(spec: str) -> dict:
+    # "media=10/60,text=20/60" -> {"media": (10, 60.0), "text": (20, 60.0)}
+    limits = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        kind, rule = part.split("=", 1)
+        count, window = rule.split("/", 1)
+        limits[kind.strip()] = (int(count), float(window))
+    return limits
+
+class SlidingWindowLimiter:
+    def __init__(self, limits: dict, max_keys: int = 50000):
+        self.limits = limits
+        self.max_keys = max_keys
+        self._hits: OrderedDict[tuple, deque] = OrderedDict()
+        self._warned: set[tuple] = set()
+        self._groups: dict[tuple, tuple] = {}  # (media_group_id, вердикт) — альбом рахуємо один раз
+        self.dropped = 0
+
+    def same_group(self, uid: int, kind: str, group: str | None) -> bool:
+        last = self._groups.get((uid, kind))
+        return group is not None and last is not None and last[0] == group
+
+    def mark_group(self, uid: int, kind: str, group: str | None, verdict: str):
+        if group is not None:
+            self._groups[(uid, kind)] = (group, verdict)
+
+    def block(self, uid: int, kind: str) -> str:
+        # зовнішня причина відмови (напр. годинна квота) з тією ж логікою попередження
+        self.dropped += 1
+        key = (uid, kind)
+        if key in self._warned:
+            return DROP
+        self._warned.add(key)
+        return WARN
+
+    def clear(self, uid: int, kind: str):
+        self._warned.discard((uid, kind))
+
+    def hit(self, uid: int, kind: str, group: str | None = None, now: float | None = None) -> str:
+        rule = self.limits.get(kind)
+        if rule is None:
+            return OK
+        key = (uid, kind)
+        if self.same_group(uid, kind, group):
+            # решта альбому отримує той самий вердикт, що й перший елемент
+            return OK if self._groups[key][1] == OK else DROP
+        verdict = self._hit(key, rule, now)
+        if group is not None:
+            self._groups[key] = (group, verdict)
+        return verdict
+
+    def _hit(self, key: tuple, rule: tuple, now: float | None) -> str:
+        limit, window = rule
+        now = time.monotonic() if now is None else now
+        q = self._hits.get(key)
+        if q is None:
+            q = self._hits[key] = deque()
+            if len(self._hits) > self.max_keys:
+                old, _ = self._hits.popitem(last=False)
+                self._warned.discard(old)
+                self._groups.pop(old, None)
+        else:
+            self._hits.move_to_end(key)
+        while q and now - q[0] >= window:
+            q.popleft()
+        if len(q) < limit:
+            q.append(now)
+            self._warned.discard(key)
+            return OK
+        # попереджаємо лише раз за епізод флуду, далі мовчки відкидаємо
+        return self.block(*key)
@@ -0,0 +1,166 @@
+import asyncio, time
+
+# ========= РЕТЕНШН =========
+# inbox лише росте: покинуті чернетки, відхилені й давно опубліковані репорти.
+# Фонова задача порціями (коротка транзакція на порцію) видаляє чернетки й
+# переносить холодні репорти в окрему базу-архів (ATTACH), а звільнені сторінки
+# повертає incremental_vacuum малими кроками — без зупинки бота. Це працює лише з
+# auto_vacuum=INCREMENTAL (нові бази); наявну базу переводить тільки повний VACUUM, який
+# блокує запис і потребує ще стільки ж місця на диску — тож не тут, а вручну: /vacuum.
+# Rollup-и (stats_daily, geo_cells) не чіпаємо: статистика й гарячі точки зберігають історію.
+
+def parse_days(spec: str) -> dict:
+    # "rejected=30,published=180" -> {"rejected": 30, "published": 180}
+    out = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            status, days = part.split("=", 1)
+            out[status.strip()] = int(days)
+    return out
+
+async def _columns(conn, table: str, schema: str = "main") -> list[str]:
+    async with conn.execute(f"PRAGMA {schema}.table_info({table})") as cur:
+        return [r[1] for r in await cur.fetchall()]
+
+class LeaseLost(Exception):
+    pass
+
+class Retention:
+    def __init__(self, db, archive_path: str, archive: dict, purge: dict, lease=None,
+                 interval: float = 6 * 3600, batch: int = 200, vacuum_pages: int = 256, pause: float = 0.2):
+        self.db = db
+        self.archive_path = archive_path
+        self.archive = archive      # статус -> днів після рішення, далі в архів
+        self.purge = purge          # статус -> днів від створення, далі видаляємо
+        self.lease = lease
+        self.interval = interval
+        self.batch = batch
+        self.vacuum_pages = vacuum_pages
+        self.pause = pause          # між порціями — щоб хендлери встигали писати
+        self._task: asyncio.Task | None = None
+        self.archived = 0
+        self.purged = 0
+        self.vacuumed_pages = 0
+
+    async def _prepare(self):
+        await self.db.attach(self.archive_path, "archive")
+        async with self.db.tx() as conn:
+            await conn.execute("CREATE TABLE IF NOT EXISTS archive.inbox(id INTEGER PRIMARY KEY, archived_ts INT)")
+            await conn.execute("""CREATE TABLE IF NOT EXISTS archive.inbox_media(
+                inbox_id INTEGER,
+                idx INT,
+                PRIMARY KEY(inbox_id, idx)
+            )""")
+            # нові колонки з міграцій live-бази доростають в архіві самі
+            for table in ("inbox", "inbox_media"):
+                have = set(await _columns(conn, table, "archive"))
+                for col in await _columns(conn, table):
+                    if col not in have:
+                        await conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {col}")
+
+    async def _renew(self):
+        # короткий лізинг продовжуємо між порціями; якщо його перехопили — зупиняємо прохід
+        if self.lease is not None and not await self.lease.acquire():
+            raise LeaseLost
+
+    async def _ids(self, where: str, params) -> list[int]:
+        rows = await self.db.fetchall(f"SELECT id FROM inbox WHERE {where} ORDER BY id LIMIT ?", (*params, self.batch))
+        return [r[0] for r in rows]
+
+    async def _purge_batch(self, status: str, days: int) -> int:
+        ids = await self._ids("status=? AND ts<?", (status, int(time.time()) - days * 86400))
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        async with self.db.tx() as conn:
+            await conn.execute(f"DELETE FROM media_uid WHERE inbox_id IN ({marks})", ids)
+            await conn.execute(f"DELETE FROM inbox_media WHERE inbox_id IN ({marks})", ids)
+            await conn.execute(f"DELETE FROM inbox WHERE id IN ({marks})", ids)
+        self.purged += len(ids)
+        return len(ids)
+
+    async def _archive_batch(self, status: str, days: int) -> int:
+        ids = await self._ids("status=? AND COALESCE(decided_ts, ts)<?", (status, int(time.time()) - days * 86400))
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+        # дві транзакції: спершу копія в архів (ідемпотентна), потім видалення з live-бази.
+        # У WAL коміт кількох баз не атомарний разом — так збій між ними дасть лише повторну копію.
+        async with self.db.tx() as conn:
+            for table, key in (("inbox", "id"), ("inbox_media", "inbox_id")):
+                cols = ", ".join(await _columns(conn, table))
+                extra = ", archived_ts" if table == "inbox" else ""
+                now = f", {int(time.time())}" if table == "inbox" else ""
+                await conn.execute(
+                    f"INSERT OR REPLACE INTO archive.{table}({cols}{extra}) "
+                    f"SELECT {cols}{now} FROM main.{table} WHERE {key} IN ({marks})", ids
+                )
+        async with self.db.tx() as conn:
+            await conn.execute(f"DELETE FROM media_uid WHERE inbox_id IN ({marks})", ids)
+            await conn.execute(f"DELETE FROM inbox_media WHERE inbox_id IN ({marks})", ids)
+            await conn.execute(f"DELETE FROM inbox WHERE id IN ({marks})", ids)
+        self.archived += len(ids)
+        return len(ids)
+
+    async def _vacuum(self):
+        if (await self.db.fetchone("PRAGMA main.auto_vacuum"))[0] != 2:
+            return   # без INCREMENTAL прагма нічого не звільняє
+        free = (await self.db.fetchone("PRAGMA freelist_count"))[0]
+        while free > 0:
+            await self._renew()
+            async with self.db.tx() as conn:
+                # прагма звільняє по сторінці на крок — треба дочитати всі рядки
+                async with conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})") as cur:
+                    await cur.fetchall()
+            left = (await self.db.fetchone("PRAGMA freelist_count"))[0]
+            if left >= free:
+                break
+            self.vacuumed_pages += free - left
+            free = left
+            await asyncio.sleep(self.pause)
+
+    async def run_once(self) -> tuple[int, int]:
+        purged = archived = 0
+        for status, days in self.purge.items():
+            while n := await self._purge_batch(status, days):
+                purged += n
+                await asyncio.sleep(self.pause)
+                await self._renew()
+        for status, days in self.archive.items():
+            while n := await self._archive_batch(status, days):
+                archived += n
+                await asyncio.sleep(self.pause)
+                await self._renew()
+        await self._vacuum()
+        return purged, archived
+
+    async def _run(self):
+        try:
+            await self._prepare()
+        except Exception as e:
+            print("RETENTION DISABLED:", e)
+            return
+        while True:
+            try:
+                if self.lease is None or await self.lease.acquire():
+                    t0 = time.perf_counter()
+                    purged, archived = await self.run_once()
+                    if purged or archived:
+                        print(f"RETENTION: purged {purged}, archived {archived} in {time.perf_counter() - t0:.1f}s")
+            except LeaseLost:
+                print("RETENTION: lease lost, pass stopped")
+            except Exception as e:
+                print("RETENTION ERROR:", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            if self.lease:
+                await self.lease.release()
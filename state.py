@@ -0,0 +1,144 @@
+import asyncio, json, time
+
+# ========= СТАН КРОКІВ =========
+# Очікувані кроки (локація, коментар, правка адміна) живуть не в context.user_data
+# процесу, а в спільному бекенді — тоді будь-який воркер uvicorn може обробити
+# будь-який апдейт, а рестарт не губить недозаповнені репорти.
+# scope: "u:<user_id>" або "c:<chat_id>".
+def user_scope(uid: int) -> str:
+    return f"u:{uid}"
+
+def chat_scope(chat_id: int) -> str:
+    return f"c:{chat_id}"
+
+class StateStore:
+    async def load(self, scope: str) -> dict:
+        raise NotImplementedError
+
+    async def set(self, scope: str, key: str, value):
+        raise NotImplementedError
+
+    async def pop(self, scope: str, key: str, default=None):
+        raise NotImplementedError
+
+    async def delete(self, scope: str, key: str):
+        await self.pop(scope, key)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class MemoryStateStore(StateStore):
+    # лише для одного процесу (локальна розробка)
+    def __init__(self):
+        self._data: dict[str, dict] = {}
+
+    async def load(self, scope: str) -> dict:
+        return dict(self._data.get(scope, {}))
+
+    async def set(self, scope: str, key: str, value):
+        self._data.setdefault(scope, {})[key] = value
+
+    async def pop(self, scope: str, key: str, default=None):
+        d = self._data.get(scope)
+        if not d:
+            return default
+        v = d.pop(key, default)
+        if not d:
+            del self._data[scope]
+        return v
+
+_DELETED = object()
+
+class SQLiteStateStore(StateStore):
+    # записи накопичуються flush_delay секунд і йдуть в БД однією транзакцією;
+    # до флашу власний процес бачить їх із буфера
+    def __init__(self, db, flush_delay: float = 0.05, ttl: int = 86400):
+        self.db = db
+        self.flush_delay = flush_delay
+        self.ttl = ttl
+        self._pending: dict[str, dict] = {}
+        self._flushing: dict[str, dict] = {}   # батч, що саме пишеться в БД
+        self._flusher: asyncio.Task | None = None
+
+    async def load(self, scope: str) -> dict:
+        rows = await self.db.fetchall("SELECT key, value FROM conv_state WHERE scope=?", (scope,))
+        data = {k: json.loads(v) for k, v in rows}
+        for layer in (self._flushing, self._pending):
+            for k, v in layer.get(scope, {}).items():
+                if v is _DELETED:
+                    data.pop(k, None)
+                else:
+                    data[k] = v
+        return data
+
+    async def set(self, scope: str, key: str, value):
+        self._pending.setdefault(scope, {})[key] = value
+        self._schedule()
+
+    async def pop(self, scope: str, key: str, default=None):
+        data = await self.load(scope)
+        if key not in data:
+            return default
+        await self.delete(scope, key)
+        return data[key]
+
+    async def delete(self, scope: str, key: str):
+        self._pending.setdefault(scope, {})[key] = _DELETED
+        self._schedule()
+
+    def _schedule(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        self._flushing = batch
+        now = int(time.time())
+        upserts, deletes = [], []
+        for scope, kv in batch.items():
+            for k, v in kv.items():
+                if v is _DELETED:
+                    deletes.append((scope, k))
+                else:
+                    upserts.append((scope, k, json.dumps(v), now))
+        try:
+            async with self.db.tx() as conn:
+                if upserts:
+                    await conn.executemany(
+                        "INSERT INTO conv_state(scope, key, value, updated) VALUES(?,?,?,?) "
+                        "ON CONFLICT(scope, key) DO UPDATE SET value=excluded.value, updated=excluded.updated",
+                        upserts
+                    )
+                if deletes:
+                    await conn.executemany("DELETE FROM conv_state WHERE scope=? AND key=?", deletes)
+        except Exception as e:
+            # нові зміни за час флашу мають пріоритет над старими
+            for scope, kv in batch.items():
+                cur = self._pending.setdefault(scope, {})
+                for k, v in kv.items():
+                    cur.setdefault(k, v)
+            print("STATE FLUSH ERROR:", e)
+            return 0
+        finally:
+            self._flushing = {}
+        return len(upserts) + len(deletes)
+
+    async def start(self):
+        # кроки, покинуті понад ttl, вже нікому не потрібні
+        await self.db.execute("DELETE FROM conv_state WHERE updated<?", (int(time.time()) - self.ttl,))
+
+    async def stop(self):
+        if self._flusher is not None and not self._flusher.done():
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,179 @@
+import asyncio, time, aiosqlite
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+
+# ========= SQLITE =========
+# одне довгоживуче зʼєднання на процес: без нового потоку й open() на кожен хендлер,
+# WAL дозволяє читати паралельно із записом, busy_timeout замість "database is locked"
+PRAGMAS = (
+    "PRAGMA auto_vacuum=INCREMENTAL",   # діє лише на новій базі; наявну переводить enable_incremental_vacuum
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+class _Statement:
+    # як aiosqlite: і await conn.execute(...), і async with conn.execute(...) as cur
+    def __init__(self, timed, coro):
+        self._timed = timed
+        self._coro = coro
+        self._cur = None
+
+    async def _run(self):
+        with self._timed:
+            return await self._coro
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def __aenter__(self):
+        self._cur = await self._run()
+        return self._cur
+
+    async def __aexit__(self, *exc):
+        await self._cur.close()
+
+class TxConnection:
+    # те, що віддає tx(): кожен statement транзакції — окремий ряд метрик (Storage._timed),
+    # а не лише весь блок як query="tx"
+    def __init__(self, db: "Storage"):
+        self._db = db
+
+    def execute(self, sql: str, params=()):
+        return _Statement(self._db._timed(sql), self._db.conn.execute(sql, params))
+
+    def executemany(self, sql: str, seq):
+        return _Statement(self._db._timed(sql), self._db.conn.executemany(sql, seq))
+
+class Storage:
+    def __init__(self, path: str = "bot.db", cached_statements: int = 256):
+        self.path = path
+        self.cached_statements = cached_statements  # кеш підготовлених statement-ів sqlite3
+        self.conn: aiosqlite.Connection | None = None
+        self._wlock = asyncio.Lock()
+        self._after_commit: list = []   # fn() поточної транзакції — після успішного коміту
+        self.observe = None        # fn(label, started, failed) — латентність запитів (metrics.py)
+        self.observe_lock = None   # fn(waited) — очікування локу запису
+
+    async def open(self):
+        if self.conn is not None:
+            return
+        self.conn = await aiosqlite.connect(self.path, cached_statements=self.cached_statements)
+        for pragma in PRAGMAS:
+            await self.conn.execute(pragma)
+
+    async def close(self):
+        if self.conn is None:
+            return
+        try:
+            async with self._wlock:
+                await self.conn.commit()
+                await self.conn.execute("PRAGMA optimize")
+        finally:
+            await self.conn.close()
+            self.conn = None
+
+    async def attach(self, path: str, name: str):
+        # ATTACH неможливий посеред транзакції — під локом запису, після коміту
+        async with self._wlock:
+            async with self.conn.execute("PRAGMA database_list") as cur:
+                if any(r[1] == name for r in await cur.fetchall()):
+                    return
+            await self.conn.commit()
+            await self.conn.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+
+    async def enable_incremental_vacuum(self) -> bool:
+        # режим auto_vacuum наявної бази змінює лише повний VACUUM — одноразово, під локом запису
+        if (await self.fetchone("PRAGMA main.auto_vacuum"))[0] == 2:
+            return False
+        async with self._wlock:
+            await self.conn.commit()
+            await self.conn.execute("PRAGMA main.auto_vacuum=INCREMENTAL")
+            await self.conn.execute("VACUUM main")
+        return True
+
+    @contextmanager
+    def _timed(self, sql: str):
+        if self.observe is None:
+            yield
+            return
+        t0, failed = time.perf_counter(), False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.observe(" ".join(sql.split())[:80], t0, failed)
+
+    # ---- читання. Без локу зʼєднання спільне, тож видно й незакомічені зміни чужої
+    # транзакції. committed=True чекає її кінця — для читань, за якими йдуть побічні
+    # ефекти (напр. відправка з outbox), щоб не діяти за рядком, який потім відкотять.
+    # Лок не реентрантний — committed не викликати зсередини tx().
+    async def fetchone(self, sql: str, params=(), committed: bool = False):
+        async with (self._wlock if committed else nullcontext()):
+            with self._timed(sql):
+                async with self.conn.execute(sql, params) as cur:
+                    return await cur.fetchone()
+
+    async def fetchall(self, sql: str, params=(), committed: bool = False):
+        async with (self._wlock if committed else nullcontext()):
+            with self._timed(sql):
+                async with self.conn.execute(sql, params) as cur:
+                    return await cur.fetchall()
+
+    # ---- запис
+    @asynccontextmanager
+    async def tx(self):
+        # одна транзакція = один лок, щоб конкурентні хендлери не комітили чужі зміни
+        t0 = time.perf_counter()
+        async with self._wlock:
+            if self.observe_lock is not None:
+                self.observe_lock(time.perf_counter() - t0)
+            with self._timed("tx"):
+                try:
+                    yield TxConnection(self)
+                except BaseException:
+                    self._after_commit.clear()
+                    await self.conn.rollback()
+                    raise
+                await self.conn.commit()
+            hooks, self._after_commit = self._after_commit, []
+        for fn in hooks:
+            fn()
+
+    def after_commit(self, fn):
+        # лише зсередини tx(): fn виконається після коміту, при відкаті — ні
+        self._after_commit.append(fn)
+
+    async def execute(self, sql: str, params=()):
+        async with self.tx() as conn:
+            return await conn.execute(sql, params)
+
+    async def executemany(self, sql: str, seq):
+        async with self.tx() as conn:
+            return await conn.executemany(sql, seq)
+
+    # ---- міграції: версія схеми живе в PRAGMA user_version,
+    # застосовуються лише кроки з номером > поточної версії, кожен у своїй транзакції
+    async def schema_version(self) -> int:
+        return (await self.fetchone("PRAGMA user_version"))[0]
+
+    async def migrate(self, steps) -> int:
+        target = len(steps)
+        if await self.schema_version() >= target:
+            return target
+        for version, step in enumerate(steps, 1):
+            async with self.tx() as conn:
+                await conn.execute("BEGIN IMMEDIATE")
+                # перевіряємо ще раз під локом — інший процес міг уже мігрувати
+                async with conn.execute("PRAGMA user_version") as cur:
+                    if (await cur.fetchone())[0] >= version:
+                        continue
+                await step(conn)
+                await conn.execute(f"PRAGMA user_version={version}")
+            print(f"DB: migrated to schema v{version} ({step.__name__})")
+        return target
@@ -0,0 +1,116 @@
+import asyncio, time
+from collections import OrderedDict
+
+# ========= КЕШ КОРИСТУВАЧІВ =========
+# LRU-кеш рядків users + write-behind: зміни (seen_menu, trust, лічильники) лише
+# позначають рядок брудним, а в БД потрапляють пачкою по таймеру та на shutdown.
+USER_FIELDS = ("trust", "last_reset", "hourly_count", "seen_menu")
+
+# trust і seen_menu лише зростають — MAX не дасть застарілому кешу іншого воркера їх відкотити
+UPSERT_SQL = (
+    "INSERT INTO users(user_id, trust, last_reset, hourly_count, seen_menu) VALUES(?,?,?,?,?) "
+    "ON CONFLICT(user_id) DO UPDATE SET trust=MAX(trust, excluded.trust), last_reset=excluded.last_reset, "
+    "hourly_count=excluded.hourly_count, seen_menu=MAX(seen_menu, excluded.seen_menu)"
+)
+
+class UserCache:
+    def __init__(self, db, maxsize: int = 10000, flush_interval: float = 5.0):
+        self.db = db
+        self.maxsize = max(1, maxsize)
+        self.flush_interval = flush_interval
+        self._rows: OrderedDict[int, dict] = OrderedDict()
+        self._dirty: dict[int, dict] = {}   # витіснені брудні рядки живуть тут до флашу
+        self._task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, uid: int) -> dict:
+        row = self._rows.get(uid)
+        if row is not None:
+            self._rows.move_to_end(uid)
+            self.hits += 1
+            return row
+        row = self._dirty.get(uid)
+        if row is None:
+            self.misses += 1
+            r = await self.db.fetchone(
+                "SELECT trust, last_reset, hourly_count, seen_menu FROM users WHERE user_id=?", (uid,)
+            )
+            # інший корутин міг встигнути завантажити цей рядок, поки ми чекали БД
+            row = self._rows.get(uid) or self._dirty.get(uid)
+            if row is None and r:
+                row = {f: (v or 0) for f, v in zip(USER_FIELDS, r)}
+            elif row is None:
+                row = {"trust": 0, "last_reset": int(time.time()), "hourly_count": 0, "seen_menu": 0}
+                self._dirty[uid] = row
+        self._put(uid, row)
+        return row
+
+    def peek(self, uid: int) -> dict | None:
+        # без звернення до БД: лише те, що вже в памʼяті
+        return self._rows.get(uid) or self._dirty.get(uid)
+
+    def touch(self, uid: int, row: dict):
+        self._dirty[uid] = row
+
+    def _put(self, uid: int, row: dict):
+        self._rows[uid] = row
+        self._rows.move_to_end(uid)
+        while len(self._rows) > self.maxsize:
+            self._rows.popitem(last=False)
+
+    async def update(self, uid: int, **fields) -> dict:
+        row = await self.get(uid)
+        row.update(fields)
+        self._dirty[uid] = row
+        return row
+
+    async def bump_trust(self, uid: int, cap: int) -> int:
+        # інкремент — атомарно в БД: кешований рядок іншого воркера може бути застарілим,
+        # і MAX(trust, excluded.trust) при флаші загубив би приріст
+        await self.db.execute(
+            "INSERT INTO users(user_id, trust) VALUES(?, MIN(1, ?)) "
+            "ON CONFLICT(user_id) DO UPDATE SET trust=MIN(trust+1, ?)", (uid, cap, cap)
+        )
+        return await self.trust(uid)
+
+    async def trust(self, uid: int) -> int:
+        # свіже значення з БД (його змінюють і інші воркери) + оновлення кешу
+        if self.peek(uid) is None:
+            return (await self.get(uid))["trust"]   # промах і так читає рядок з БД
+        r = await self.db.fetchone("SELECT trust FROM users WHERE user_id=?", (uid,))
+        row = await self.get(uid)
+        if r is not None:
+            row["trust"] = r[0] or 0
+        return row["trust"]
+
+    async def flush(self) -> int:
+        if not self._dirty:
+            return 0
+        batch, self._dirty = self._dirty, {}
+        params = [(uid, *(row[f] for f in USER_FIELDS)) for uid, row in batch.items()]
+        try:
+            await self.db.executemany(UPSERT_SQL, params)
+        except Exception as e:
+            # повертаємо в брудні ті, що не змінились повторно за час флашу
+            for uid, row in batch.items():
+                self._dirty.setdefault(uid, row)
+            print("USER CACHE FLUSH ERROR:", e)
+            return 0
+        return len(params)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -0,0 +1,50 @@
+import contextvars
+from contextlib import contextmanager
+import metrics
+
+# ========= ВІДПОВІДЬ У ВЕБХУК =========
+# Telegram дозволяє повернути в тілі відповіді на вебхук один виклик Bot API.
+# Поки обробляється апдейт, перший придатний виклик не йде в мережу, а
+# запамʼятовується й віддається як відповідь вебхука; решта — звичайним HTTPS.
+# Придатні лише методи, результат яких коду не потрібен (PTB приймає True),
+# і без файлів. Помилку такого виклику Telegram не повертає — тож лише
+# «косметичні» методи: відповідь на кнопку, правка/видалення повідомлення.
+INLINE_METHODS = frozenset({
+    "answerCallbackQuery", "editMessageText", "editMessageCaption",
+    "editMessageReplyMarkup", "deleteMessage", "sendChatAction",
+})
+_OK_TRUE = b'{"ok":true,"result":true}'
+
+class ReplySlot:
+    def __init__(self):
+        self.open = True
+        self.payload: dict | None = None
+
+_slot: contextvars.ContextVar[ReplySlot | None] = contextvars.ContextVar("webhook_reply", default=None)
+
+@contextmanager
+def capture():
+    # таски й таймери, створені під час обробки, успадковують контекст —
+    # після відповіді слот закритий, і їхні виклики йдуть у мережу
+    slot = ReplySlot()
+    token = _slot.set(slot)
+    try:
+        yield slot
+    finally:
+        slot.open = False
+        _slot.reset(token)
+
+class ReplyingRequest(metrics.InstrumentedRequest):
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        slot = _slot.get()
+        api_method = url.rsplit("/", 1)[-1]
+        if (slot is not None and slot.open and slot.payload is None and api_method in INLINE_METHODS
+                and request_data is not None and not request_data.contains_files):
+            slot.payload = {"method": api_method, **request_data.parameters}
+            metrics.API_INLINE.inc(api_method)
+            return 200, _OK_TRUE
+        return await super().do_request(
+            url, method, request_data=request_data, read_timeout=read_timeout,
+            write_timeout=write_timeout, connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+        )